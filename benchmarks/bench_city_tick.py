@@ -0,0 +1,83 @@
+"""بنچمارک تیک دسته‌ای شهرها
+
+یک دیتابیس موقت با تعداد زیادی بازیکن و شهر ساخته می‌شود و تیک‌ها با بودجه
+زمانی پیش‌فرض تا پایان یک دور کامل اجرا می‌شوند.
+
+    python benchmarks/bench_city_tick.py --cities 1000000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code1
+
+INSERT_CHUNK = 50_000
+
+
+def populate(bot: code1.AdvancedStrategicGameBot, cities: int, houses_every: int):
+    """ساخت بازیکن‌ها، شهرها و خانه‌ها؛ همه شهرها برای تیک کهنه هستند"""
+    stale = time.time() - 2 * code1.CITY_SIM_INTERVAL
+    for start in range(1, cities + 1, INSERT_CHUNK):
+        ids = range(start, min(start + INSERT_CHUNK, cities + 1))
+        bot.cursor.executemany(
+            'INSERT INTO players (user_id, username) VALUES (?, ?)',
+            ((user_id, f'player{user_id}') for user_id in ids)
+        )
+        bot.cursor.executemany('''
+            INSERT INTO cities (id, user_id, city_name, position_x, position_y, last_update_time)
+            VALUES (?, ?, 'شهر اصلی', ?, ?, ?)
+        ''', (
+            (user_id, user_id, user_id % code1.MAP_SIZE, user_id // code1.MAP_SIZE % code1.MAP_SIZE, stale)
+            for user_id in ids
+        ))
+        bot.cursor.executemany(
+            "INSERT INTO buildings (city_id, building_type, level) VALUES (?, 'houses', 2)",
+            ((user_id,) for user_id in ids if user_id % houses_every == 0)
+        )
+        bot.conn.commit()
+
+
+async def run_full_pass(bot: code1.AdvancedStrategicGameBot, budget: float) -> tuple:
+    """اجرای تیک‌ها تا وقتی که نشانگر پیمایش به ابتدای جدول برگردد"""
+    ticks = processed = 0
+    while True:
+        processed += await bot.run_city_tick(budget)
+        ticks += 1
+        if bot.city_sim_cursor == 0:
+            return ticks, processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cities', type=int, default=1_000_000)
+    parser.add_argument('--budget', type=float, default=code1.CITY_TICK_BUDGET)
+    parser.add_argument('--batch', type=int, default=code1.CITY_SIM_BATCH)
+    parser.add_argument('--houses-every', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger('code1').setLevel(logging.WARNING)
+    code1.CITY_SIM_BATCH = args.batch
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        bot = code1.AdvancedStrategicGameBot('1:bench')
+
+        started = time.monotonic()
+        populate(bot, args.cities, args.houses_every)
+        print(f"ساخت {args.cities:,} شهر: {time.monotonic() - started:.1f} ثانیه")
+
+        started = time.monotonic()
+        ticks, processed = asyncio.run(run_full_pass(bot, args.budget))
+        elapsed = time.monotonic() - started
+        print(f"دور کامل: {processed:,} شهر در {elapsed:.1f} ثانیه و {ticks} تیک "
+              f"({processed / max(elapsed, 1e-6):,.0f} شهر در ثانیه)")
+        bot.conn.close()
+
+
+if __name__ == '__main__':
+    main()
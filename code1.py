@@ -1,28 +1,347 @@
 import asyncio
 import logging
 from balethon import Client
-from balethon.conditions import private, regex
+from balethon.conditions import private, regex, create
 from balethon.objects import Message, InlineKeyboard, ReplyKeyboard, CallbackQuery
+from balethon.errors import FloodError, TooManyRequestsError
 import sqlite3
 import json
 import random
 import datetime
 from typing import Dict, List, Optional
 import math
+import multiprocessing
+import os
+import gzip
+import shutil
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DATABASE_PATH = 'advanced_strategic_game.db'
+
+# تنظیمات پشتیبان‌گیری: تعداد صفحات کپی‌شده در هر گام و مکث بین گام‌ها (ثانیه)
+BACKUP_DIR = 'backups'
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.01
+BACKUP_INTERVAL = 6 * 3600
+BACKUP_KEEP = 10
+# فقط این پسوندها نسخه پشتیبان کامل هستند؛ فایل‌های موقت part و restore کنار گذاشته می‌شوند
+SNAPSHOT_SUFFIXES = ('.db', '.db.gz')
+
+# پاداش‌های پایه؛ هر روز/هفته پیاپی ۱۰٪ بیشتر تا سقف زنجیره
+REWARD_TABLES = {
+    'daily': {'gold': 500, 'food': 800, 'wood': 600, 'stone': 400, 'iron': 200, 'mana': 50},
+    'weekly': {'gold': 5000, 'food': 8000, 'wood': 6000, 'stone': 4000, 'iron': 2000, 'mana': 500},
+}
+REWARD_STREAK_BONUS = 0.1
+REWARD_STREAK_CAP = 7
+STREAK_RESET_INTERVAL = 3600
+
+# نقشه و شناسایی: اندازه نقشه، اندازه هر منطقه و عمر ایندکس/گزارش‌ها (ثانیه)
+MAP_SIZE = 1000
+REGION_SIZE = 100
+SCOUT_INDEX_TTL = 300
+SPY_REPORT_TTL = 120
+SCOUT_BAND_RANGE = 3
+
+# شبیه‌سازی شهر: ظرفیت مسکن، مصرف غذا، نرخ رشد و رضایت (در ساعت)، دفاع و درآمد
+CITY_BASE_HOUSING = 2000
+HOUSING_PER_CITY_LEVEL = 1000
+HOUSING_PER_HOUSE_LEVEL = 500
+FOOD_PER_CITIZEN_DAY = 0.25
+CITY_GROWTH_RATE = 0.02
+HAPPINESS_RATE = 0.1
+CITY_BASE_DEFENSE = 200
+DEFENSE_PER_CITY_LEVEL = 50
+DEFENSE_PER_WALL_LEVEL = 150
+INCOME_PER_CITIZEN = 0.5
+TAX_RATES = (5, 10, 20)
+
+# فاصله زمانی (ثانیه) بین دو بروزرسانی هر شهر و اندازه/بودجه زمانی هر تیک دسته‌ای
+CITY_SIM_STEP = 600
+CITY_SIM_INTERVAL = 3600
+CITY_SIM_BATCH = 10000
+CITY_TICK_BUDGET = 2.0
+# فاصله اجرای تیک دسته‌ای؛ هر تیک از جایی که تیک قبلی متوقف شده ادامه می‌دهد
+CITY_TICK_INTERVAL = 60
+
+CITY_SIM_QUERY = '''
+    SELECT c.id, c.population, c.happiness, c.level, c.tax_rate, c.last_update_time, p.food,
+           COALESCE(SUM(CASE WHEN b.building_type = 'houses' THEN b.level END), 0),
+           COALESCE(SUM(CASE WHEN b.building_type = 'walls' THEN b.level END), 0),
+           c.user_id
+    FROM cities c
+    JOIN players p ON p.user_id = c.user_id
+    LEFT JOIN buildings b ON b.city_id = c.id
+'''
+
+
+def simulate_city_batch(rows: List[tuple], now: float) -> tuple:
+    """پیشروی دسته‌ای شهرها تا زمان now
+
+    ورودی ردیف‌های (شناسه، جمعیت، رضایت، سطح، مالیات، زمان آخرین بروزرسانی،
+    غذای بازیکن، سطح خانه‌ها، سطح دیوارها، شناسه بازیکن) است و خروجی دو لیست
+    آماده برای executemany: ردیف‌های شهر و غذای مصرف‌شده هر بازیکن. شهروندان
+    در مدت غیبت از انبار غذای بازیکن می‌خورند و نسبت انبار به مصرف روزانه
+    (در شروع بازه) هدف رضایت را تعیین می‌کند. رضایت به صورت نمایی به سمت هدفش می‌رود و جمعیت با رشد
+    لجستیک به سمت ظرفیت مسکن؛ هر دو شکل بسته دارند، پس هزینه هر شهر به
+    مدت غیبت بستگی ندارد.
+    """
+    exp = math.exp
+    updates = []
+    food_used = []
+    for city_id, population, happiness, level, tax_rate, last_update, food, houses, walls, user_id in rows:
+        hours = max(now - (last_update or now), 0.0) / 3600
+        capacity = CITY_BASE_HOUSING + HOUSING_PER_CITY_LEVEL * level + HOUSING_PER_HOUSE_LEVEL * houses
+        food_ratio = min(food / max(population * FOOD_PER_CITIZEN_DAY, 1), 1.0)
+        eaten = min(round(population * FOOD_PER_CITIZEN_DAY * hours / 24), food)
+        if eaten > 0:
+            food_used.append((eaten, user_id))
+        
+        target = min(max(100 - 2 * tax_rate - 40 * (1 - food_ratio), 0), 100)
+        happiness = target + (happiness - target) * exp(-HAPPINESS_RATE * hours)
+        
+        if population > capacity:
+            population = capacity + (population - capacity) * exp(-CITY_GROWTH_RATE * hours)
+        elif population > 0:
+            rate = CITY_GROWTH_RATE * (happiness - 50) / 50
+            population = capacity / (1 + (capacity - population) / population * exp(-rate * hours))
+        
+        defense = CITY_BASE_DEFENSE + DEFENSE_PER_CITY_LEVEL * level + DEFENSE_PER_WALL_LEVEL * walls
+        updates.append((int(population), round(happiness), defense, now, city_id))
+    return updates, food_used
+
+
+# محدودیت درخواست هر مسیر: (حداکثر تعداد، طول پنجره به ثانیه)
+THROTTLE_LIMITS = {
+    'default': (20, 10.0),
+    '/start': (3, 30.0),
+    'collect_resources': (5, 10.0),
+    'daily_reward': (5, 10.0),
+    'weekly_reward': (5, 10.0),
+}
+THROTTLE_MAX_ENTRIES = 100_000
+
+# درخت تحقیقات: هزینه به مانا، زمان به ساعت، پیش‌نیازها و اثر هر تکنولوژی
+MODIFIER_KEYS = ('production', 'attack', 'build_speed')
+TECH_TREE = {
+    'agriculture': {
+        'name': '🌾 کشاورزی', 'cost': 50, 'hours': 1,
+        'requires': [], 'effects': {'production': 0.10}
+    },
+    'masonry': {
+        'name': '🪨 سنگ‌تراشی', 'cost': 80, 'hours': 2,
+        'requires': [], 'effects': {'build_speed': 0.10}
+    },
+    'mining': {
+        'name': '⛏️ معدن‌کاری', 'cost': 120, 'hours': 3,
+        'requires': ['agriculture'], 'effects': {'production': 0.15}
+    },
+    'metallurgy': {
+        'name': '⚙️ متالورژی', 'cost': 200, 'hours': 4,
+        'requires': ['mining'], 'effects': {'attack': 0.10}
+    },
+    'engineering': {
+        'name': '🏗️ مهندسی', 'cost': 250, 'hours': 6,
+        'requires': ['masonry', 'mining'], 'effects': {'build_speed': 0.20}
+    },
+    'tactics': {
+        'name': '♟️ تاکتیک‌های جنگی', 'cost': 300, 'hours': 8,
+        'requires': ['metallurgy'], 'effects': {'attack': 0.15}
+    },
+}
+
+
+# حداکثر تعداد بازیکنانی که بردار ضرایبشان در حافظه نگه داشته می‌شود
+MODIFIER_CACHE_SIZE = 10_000
+
+# مسابقات: تعداد شرکت‌کننده برای شروع خودکار، اندازه هر بسته نبرد برای پروسس‌ها
+TOURNAMENT_SIZE = 64
+TOURNAMENT_CHUNK_SIZE = 500
+TOURNAMENT_WORKERS = os.cpu_count() or 2
+
+# ارسال پیام: حداکثر پیام در ثانیه و تعداد ارسال همزمان
+SEND_RATE = 20
+SEND_CONCURRENCY = 10
+NOTIFY_BATCH_SIZE = 20
+
+# محدودیت نرخ سرور: تعداد تلاش دوباره و مکث پیش‌فرض وقتی retry_after اعلام نشده
+SEND_MAX_RETRIES = 3
+SEND_RETRY_DELAY = 5
+
+# پیام همگانی: اندازه هر بسته گیرندگان و مدیرانی که اجازه ارسال دارند
+BROADCAST_CHUNK_SIZE = 500
+ADMIN_IDS = set()
+
+
+def simulate_battles(matches: List[tuple]) -> List[tuple]:
+    """شبیه‌سازی یک دسته نبرد (در پروسس جداگانه اجرا می‌شود)
+
+    هر نبرد با شناسه خودش seed می‌شود تا اجرای دوباره بعد از کرش همان نتیجه را بدهد.
+    """
+    results = []
+    for match_id, player_a, power_a, player_b, power_b in matches:
+        rng = random.Random(match_id)
+        score_a = power_a * rng.uniform(0.75, 1.25)
+        score_b = power_b * rng.uniform(0.75, 1.25)
+        results.append((player_a if score_a >= score_b else player_b, match_id))
+    return results
+
+
+# جلسه‌های چندمرحله‌ای: وضعیت‌ها، عمر هر جلسه و دقت چرخ زمان (ثانیه)
+SESSION_TRAIN_COUNT = 1
+SESSION_ATTACK_TARGET = 2
+SESSION_UPGRADE_CONFIRM = 3
+SESSION_TTL = 300
+SESSION_TICK = 1.0
+SESSION_PERSIST = True
+
+# هزینه آموزش هر واحد
+UNIT_TRAINING_COST = {
+    'infantry': {'gold': 50, 'food': 20, 'iron': 10},
+    'archers': {'gold': 60, 'food': 25, 'iron': 15},
+    'cavalry': {'gold': 90, 'food': 40, 'iron': 25},
+    'siege': {'gold': 150, 'food': 30, 'iron': 60},
+}
+CITY_UPGRADE_COST = {'gold': 5000, 'wood': 3000, 'stone': 2000, 'iron': 1000}
+CITY_UPGRADE_MINUTES = 120
+
+
+class SessionStore:
+    """نگهداری وضعیت جلسه هر کاربر با انقضای خودکار روی چرخ زمان
+
+    هر جلسه یک تاپل کوچک (وضعیت، داده، تیک انقضا) است و در خانه‌ای از چرخ
+    ثبت می‌شود که با تیک انقضایش متناظر است. با جلو رفتن زمان فقط خانه‌های
+    رد شده بررسی می‌شوند، پس هزینه خواندن و انقضا به ازای هر درخواست O(1)
+    است و به تعداد جلسه‌ها بستگی ندارد.
+    """
+
+    def __init__(self, ttl: float, tick: float):
+        self.ttl_ticks = max(int(math.ceil(ttl / tick)), 1)
+        self.tick = tick
+        self.wheel = [set() for _ in range(self.ttl_ticks + 1)]
+        self.sessions = {}
+        self.current_tick = self._now_tick()
+
+    def _now_tick(self) -> int:
+        return int(time.monotonic() // self.tick)
+
+    def _advance(self):
+        """انقضای جلسه‌های خانه‌هایی که از آخرین فراخوانی رد شده‌اند"""
+        now_tick = self._now_tick()
+        steps = min(now_tick - self.current_tick, len(self.wheel))
+        for step in range(1, steps + 1):
+            slot = self.wheel[(self.current_tick + step) % len(self.wheel)]
+            for user_id in [user_id for user_id in slot if self.sessions[user_id][2] <= now_tick]:
+                slot.discard(user_id)
+                del self.sessions[user_id]
+        self.current_tick = max(self.current_tick, now_tick)
+
+    def get(self, user_id: int) -> Optional[tuple]:
+        """وضعیت و داده جلسه کاربر (یا None)"""
+        self._advance()
+        session = self.sessions.get(user_id)
+        return session[:2] if session else None
+
+    def set(self, user_id: int, state: int, payload: tuple = (), ttl: Optional[float] = None):
+        """ثبت یا جایگزینی جلسه کاربر"""
+        self._advance()
+        self.clear(user_id)
+        ttl_ticks = self.ttl_ticks if ttl is None else min(max(int(math.ceil(ttl / self.tick)), 1), self.ttl_ticks)
+        expires_tick = self.current_tick + ttl_ticks
+        self.sessions[user_id] = (state, tuple(payload), expires_tick)
+        self.wheel[expires_tick % len(self.wheel)].add(user_id)
+
+    def clear(self, user_id: int):
+        """حذف جلسه کاربر"""
+        session = self.sessions.pop(user_id, None)
+        if session:
+            self.wheel[session[2] % len(self.wheel)].discard(user_id)
+
+
+class RateLimiter:
+    """محدودکننده پنجره لغزان تقریبی برای هر کاربر و مسیر
+
+    برای هر کلید فقط شماره پنجره و تعداد درخواست‌های پنجره فعلی و قبلی
+    نگه داشته می‌شود. کلیدها به ترتیب آخرین استفاده مرتب‌اند و در هر
+    فراخوانی حداکثر دو کلید قدیمی حذف می‌شوند، پس هزینه هر درخواست O(1)
+    است و حافظه به تعداد کاربران فعال محدود می‌ماند.
+    """
+
+    def __init__(self, limits: Dict, max_entries: int):
+        self.limits = limits
+        self.max_entries = max_entries
+        self.counters = OrderedDict()
+
+    def allow(self, user_id: int, route: str, now: Optional[float] = None) -> bool:
+        """ثبت درخواست و بررسی مجاز بودن آن"""
+        if route not in self.limits:
+            route = 'default'
+        limit, window = self.limits[route]
+        now = time.monotonic() if now is None else now
+        window_index = int(now // window)
+        key = (user_id, route)
+        
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = [window_index, 0, 0]
+            self.counters[key] = counter
+        else:
+            self.counters.move_to_end(key)
+            if counter[0] != window_index:
+                counter[2] = counter[1] if counter[0] == window_index - 1 else 0
+                counter[1] = 0
+                counter[0] = window_index
+        
+        # وزن پنجره قبلی به نسبت بخشی که هنوز داخل پنجره لغزان است
+        elapsed = (now % window) / window
+        allowed = counter[2] * (1 - elapsed) + counter[1] < limit
+        if allowed:
+            counter[1] += 1
+        self._expire(now)
+        return allowed
+
+    def _expire(self, now: float):
+        """حذف کلیدهایی که دو پنجره از آخرین استفاده‌شان گذشته است"""
+        for _ in range(2):
+            if not self.counters:
+                return
+            key, counter = next(iter(self.counters.items()))
+            window = self.limits[key[1]][1]
+            if counter[0] >= int(now // window) - 1 and len(self.counters) <= self.max_entries:
+                return
+            self.counters.popitem(last=False)
+
 class AdvancedStrategicGameBot:
     def __init__(self, token: str):
         self.bot = Client(token)
         self.setup_handlers()
-        self.user_data = {}
+        self.sessions = SessionStore(SESSION_TTL, SESSION_TICK)
+        self.city_sim_cursor = 0
+        self.backup_lock = asyncio.Lock()
+        self.scout_index = {}
+        self.scout_positions = {}
+        self.scout_refresh_lock = asyncio.Lock()
+        self.spy_reports = OrderedDict()
+        self.throttle = RateLimiter(THROTTLE_LIMITS, THROTTLE_MAX_ENTRIES)
+        self.modifier_cache = OrderedDict()
+        self.battle_pool = None
+        self.background_tasks = set()
+        self.notifications = deque()
+        self.notify_lock = asyncio.Lock()
+        self.send_semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+        self.next_send_time = 0.0
+        self.setup_research()
         self.setup_database()
+        self.load_sessions()
         
     def setup_database(self):
         """ایجاد دیتابیس پیشرفته برای بازی"""
-        self.conn = sqlite3.connect('advanced_strategic_game.db', check_same_thread=False)
+        self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
         self.cursor = self.conn.cursor()
         
         # جدول بازیکنان
@@ -61,10 +380,37 @@ class AdvancedStrategicGameBot:
                 position_x INTEGER,
                 position_y INTEGER,
                 last_attack_time TEXT,
+                tax_rate INTEGER DEFAULT 10,
+                last_update_time REAL,
+                upgrade_finish_time TEXT,
                 FOREIGN KEY (user_id) REFERENCES players (user_id)
             )
         ''')
         
+        # ستون‌های شبیه‌سازی برای دیتابیس‌های قدیمی
+        self.cursor.execute('PRAGMA table_info(cities)')
+        city_columns = {row[1] for row in self.cursor.fetchall()}
+        if 'tax_rate' not in city_columns:
+            self.cursor.execute('ALTER TABLE cities ADD COLUMN tax_rate INTEGER DEFAULT 10')
+        if 'last_update_time' not in city_columns:
+            self.cursor.execute('ALTER TABLE cities ADD COLUMN last_update_time REAL')
+        if 'upgrade_finish_time' not in city_columns:
+            self.cursor.execute('ALTER TABLE cities ADD COLUMN upgrade_finish_time TEXT')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_cities_user ON cities (user_id)')
+        # فقط شهرهای در حال ارتقاء در ایندکس می‌آیند
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cities_upgrade ON cities (upgrade_finish_time)
+            WHERE upgrade_finish_time IS NOT NULL
+        ''')
+        
+        # پایتخت برای بازیکنانی که پیش از ساخت خودکار شهر ثبت نام کرده‌اند
+        self.cursor.execute('''
+            INSERT INTO cities (user_id, city_name, position_x, position_y, last_update_time)
+            SELECT user_id, 'شهر اصلی', ABS(RANDOM()) % ?, ABS(RANDOM()) % ?, ?
+            FROM players p
+            WHERE NOT EXISTS (SELECT 1 FROM cities c WHERE c.user_id = p.user_id)
+        ''', (MAP_SIZE, MAP_SIZE, time.time()))
+        
         # جدول ساختمان‌ها
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS buildings (
@@ -77,9 +423,136 @@ class AdvancedStrategicGameBot:
                 FOREIGN KEY (city_id) REFERENCES cities (id)
             )
         ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_buildings_city ON buildings (city_id)')
+        
+        # جدول دریافت پاداش‌ها؛ توکن هر دوره یکتاست تا پاداش دوبار پرداخت نشود
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reward_claims (
+                claim_token TEXT PRIMARY KEY,
+                user_id INTEGER,
+                reward_type TEXT,
+                period TEXT,
+                claimed_at TEXT,
+                rewards TEXT,
+                FOREIGN KEY (user_id) REFERENCES players (user_id)
+            )
+        ''')
+        
+        # جدول زنجیره پاداش‌ها
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reward_streaks (
+                user_id INTEGER,
+                reward_type TEXT,
+                last_period TEXT,
+                streak INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, reward_type),
+                FOREIGN KEY (user_id) REFERENCES players (user_id)
+            )
+        ''')
+        
+        # جدول تحقیقات بازیکنان
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS research (
+                user_id INTEGER,
+                tech_id TEXT,
+                finish_time TEXT,
+                completed BOOLEAN DEFAULT FALSE,
+                PRIMARY KEY (user_id, tech_id),
+                FOREIGN KEY (user_id) REFERENCES players (user_id)
+            )
+        ''')
+        
+        # ضرایب محاسبه‌شده از تحقیقات تمام‌شده
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS player_modifiers (
+                user_id INTEGER PRIMARY KEY,
+                production REAL DEFAULT 1.0,
+                attack REAL DEFAULT 1.0,
+                build_speed REAL DEFAULT 1.0,
+                FOREIGN KEY (user_id) REFERENCES players (user_id)
+            )
+        ''')
+        
+        # جداول مسابقات
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tournaments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT DEFAULT 'registration',
+                current_round INTEGER DEFAULT 0,
+                created_at TEXT,
+                finished_at TEXT,
+                winner_id INTEGER
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tournament_entries (
+                tournament_id INTEGER,
+                user_id INTEGER,
+                power INTEGER,
+                PRIMARY KEY (tournament_id, user_id),
+                FOREIGN KEY (tournament_id) REFERENCES tournaments (id)
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tournament_matches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tournament_id INTEGER,
+                round INTEGER,
+                player_a INTEGER,
+                player_b INTEGER,
+                winner_id INTEGER,
+                FOREIGN KEY (tournament_id) REFERENCES tournaments (id)
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tournament_matches_round
+            ON tournament_matches (tournament_id, round)
+        ''')
+        
+        # جدول پیام‌های همگانی و نقطه توقف هر کدام
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT,
+                status TEXT DEFAULT 'running',
+                created_by INTEGER,
+                last_user_id INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                elapsed REAL DEFAULT 0,
+                created_at TEXT,
+                finished_at TEXT
+            )
+        ''')
+        
+        # جدول جلسه‌های چندمرحله‌ای تا پس از راه‌اندازی دوباره از دست نروند
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id INTEGER PRIMARY KEY,
+                state INTEGER,
+                payload TEXT,
+                expires_at REAL
+            )
+        ''')
         
         self.conn.commit()
 
+    def setup_research(self):
+        """بارگذاری و بررسی درخت تحقیقات در زمان شروع"""
+        for tech_id, tech in TECH_TREE.items():
+            for required in tech['requires']:
+                if required not in TECH_TREE:
+                    raise ValueError(f"پیش‌نیاز ناشناخته {required} برای {tech_id}")
+            for key in tech['effects']:
+                if key not in MODIFIER_KEYS:
+                    raise ValueError(f"اثر ناشناخته {key} برای {tech_id}")
+        
+        # بردار اثر هر تکنولوژی یکبار ساخته می‌شود
+        self.tech_effects = {
+            tech_id: tuple(tech['effects'].get(key, 0.0) for key in MODIFIER_KEYS)
+            for tech_id, tech in TECH_TREE.items()
+        }
+
     def create_main_menu_keyboard(self):
         """ایجاد کیبورد اصلی بازی"""
         keyboard = ReplyKeyboard(resize_keyboard=True)
@@ -174,11 +647,36 @@ class AdvancedStrategicGameBot:
         )
         return keyboard
 
+    def throttled(self, route: Optional[str] = None):
+        """شرط balethon که درخواست‌های اضافی را پیش از رسیدن به هندلر کنار می‌گذارد
+
+        اگر مسیر داده نشود، داده کال‌بک به عنوان مسیر استفاده می‌شود.
+        """
+        @create(name="throttled")
+        async def condition(event) -> bool:
+            key = route if route is not None else getattr(event, 'data', None) or 'default'
+            if self.throttle.allow(event.from_user.id, key):
+                return True
+            if isinstance(event, CallbackQuery):
+                # پاسخ به کال‌بک تا دکمه در حالت انتظار نماند
+                await event.answer()
+            return False
+        return condition
+
     def setup_handlers(self):
         """تنظیم هندلرهای پیشرفته"""
         
+        # راه‌اندازی و توقف کارهای پس‌زمینه همراه با ربات
+        @self.bot.on_initialize()
+        async def startup(client: Client):
+            await self.start_background_jobs()
+
+        @self.bot.on_shutdown()
+        async def shutdown(client: Client):
+            await self.stop_background_jobs()
+
         # هندلر شروع - با regex به جای command
-        @self.bot.on_message(private & regex("^/start$"))
+        @self.bot.on_message(private & regex("^/start$") & self.throttled("/start"))
         async def start_game(client: Client, message: Message):
             user_id = message.from_user.id
             await self.register_player(user_id, message.from_user)
@@ -200,7 +698,7 @@ class AdvancedStrategicGameBot:
             await message.reply(welcome_text, reply_markup=self.create_main_menu_keyboard())
 
         # هندلر مدیریت شهر
-        @self.bot.on_message(private & regex("🏰 شهر من"))
+        @self.bot.on_message(private & regex("🏰 شهر من") & self.throttled("city_management"))
         async def city_management(client: Client, message: Message):
             user_id = message.from_user.id
             city_info = await self.get_city_info(user_id)
@@ -227,7 +725,7 @@ class AdvancedStrategicGameBot:
             await message.reply(city_text, reply_markup=self.create_city_management_keyboard())
 
         # هندلر مدیریت ارتش
-        @self.bot.on_message(private & regex("⚔️ ارتش من"))
+        @self.bot.on_message(private & regex("⚔️ ارتش من") & self.throttled("army_management"))
         async def army_management(client: Client, message: Message):
             user_id = message.from_user.id
             army_info = await self.get_army_info(user_id)
@@ -252,7 +750,7 @@ class AdvancedStrategicGameBot:
             await message.reply(army_text, reply_markup=self.create_army_management_keyboard())
 
         # هندلر منابع و بازار
-        @self.bot.on_message(private & regex("📊 منابع و بازار"))
+        @self.bot.on_message(private & regex("📊 منابع و بازار") & self.throttled("resources_market"))
         async def resources_market(client: Client, message: Message):
             keyboard = InlineKeyboard()
             keyboard.row(
@@ -282,7 +780,7 @@ class AdvancedStrategicGameBot:
             await message.reply(resources_text, reply_markup=keyboard)
 
         # هندلر نقشه جهان
-        @self.bot.on_message(private & regex("🗺️ نقشه جهان"))
+        @self.bot.on_message(private & regex("🗺️ نقشه جهان") & self.throttled("world_map"))
         async def world_map(client: Client, message: Message):
             keyboard = InlineKeyboard()
             keyboard.row(
@@ -313,15 +811,21 @@ class AdvancedStrategicGameBot:
             await message.reply(map_text, reply_markup=keyboard)
 
         # هندلر اقدامات سریع
-        @self.bot.on_message(private & regex("⚡ اقدامات سریع"))
+        @self.bot.on_message(private & regex("⚡ اقدامات سریع") & self.throttled("quick_actions"))
         async def quick_actions(client: Client, message: Message):
             await message.reply(
                 "⚡ **اقدامات سریع**\n\n🎯 کارهای که می‌توانید سریع انجام دهید:",
                 reply_markup=self.create_quick_actions_keyboard()
             )
 
+        # هندلر تحقیقات
+        @self.bot.on_message(private & regex("🔮 تحقیقات") & self.throttled("research_menu"))
+        async def research_menu(client: Client, message: Message):
+            research_text, keyboard = await self.build_research_menu(message.from_user.id)
+            await message.reply(research_text, reply_markup=keyboard)
+
         # هندلر پروفایل
-        @self.bot.on_message(private & regex("📋 پروفایل"))
+        @self.bot.on_message(private & regex("📋 پروفایل") & self.throttled("player_profile"))
         async def player_profile(client: Client, message: Message):
             user_id = message.from_user.id
             profile = await self.get_player_profile(user_id)
@@ -357,8 +861,72 @@ class AdvancedStrategicGameBot:
             
             await message.reply(profile_text, reply_markup=keyboard)
 
+        # هندلر پشتیبان‌گیری دستی (فقط مدیران)
+        @self.bot.on_message(private & regex("^/backup$"))
+        async def backup(client: Client, message: Message):
+            if message.from_user.id not in ADMIN_IDS:
+                return
+            snapshot_path = await self.create_snapshot(compress=True)
+            await message.reply(f"💾 **نسخه پشتیبان ساخته شد:** {os.path.basename(snapshot_path)}")
+
+        # هندلر بازگردانی پشتیبان (فقط مدیران)
+        @self.bot.on_message(private & regex(r"^/restore \S+$"))
+        async def restore(client: Client, message: Message):
+            if message.from_user.id not in ADMIN_IDS:
+                return
+            # فقط فایل‌های داخل پوشه پشتیبان قابل بازگردانی هستند
+            snapshot_path = os.path.join(BACKUP_DIR, os.path.basename(message.text.split(maxsplit=1)[1]))
+            if not snapshot_path.endswith(SNAPSHOT_SUFFIXES) or not os.path.isfile(snapshot_path):
+                await message.reply("⚠️ **فایل پشتیبان پیدا نشد.**")
+                return
+            try:
+                await self.restore_snapshot(snapshot_path)
+            except (sqlite3.DatabaseError, ValueError, OSError, EOFError) as e:
+                logger.error(f"خطا در بازگردانی {snapshot_path}: {e}")
+                await message.reply("⚠️ **فایل پشتیبان معتبر نیست؛ دیتابیس تغییری نکرد.**")
+                return
+            await message.reply(f"♻️ **دیتابیس از {os.path.basename(snapshot_path)} بازگردانی شد.**")
+
+        # هندلر پیام همگانی (فقط مدیران)
+        @self.bot.on_message(private & regex("^/broadcast "))
+        async def broadcast(client: Client, message: Message):
+            if message.from_user.id not in ADMIN_IDS:
+                return
+            text = message.text[len("/broadcast "):].strip()
+            if not text:
+                return
+            broadcast_id = await self.start_broadcast(text, message.from_user.id)
+            await message.reply(f"📢 **پیام همگانی {broadcast_id} در حال ارسال است.**")
+
+        # هندلر دریافت شناسه هدف در حمله مستقیم
+        @self.bot.on_message(private & regex(r"^\d+$") & self.throttled("attack_target"))
+        async def attack_target(client: Client, message: Message):
+            user_id = message.from_user.id
+            if self.get_session(user_id) != (SESSION_ATTACK_TARGET, ()):
+                return
+            
+            target_id = int(message.text)
+            report = await self.get_spy_report(target_id) if target_id != user_id else None
+            keyboard = InlineKeyboard()
+            if report is None:
+                keyboard.row(
+                    ("🔙 منوی حمله", "attack_menu")
+                )
+                await message.reply("⚠️ **بازیکنی با این شناسه پیدا نشد.** شناسه دیگری ارسال کنید.", reply_markup=keyboard)
+                return
+            
+            self.clear_session(user_id)
+            keyboard.row(
+                ("🕵️ جاسوسی", f"spy_player_{target_id}"),
+                ("🔙 منوی حمله", "attack_menu")
+            )
+            await message.reply(
+                f"🎯 **هدف انتخاب شد: {report['name']}**\n\n📍 مختصات: X: {report['position_x']}, Y: {report['position_y']}",
+                reply_markup=keyboard
+            )
+
         # هندلر منو - با regex به جای command
-        @self.bot.on_message(private & regex("^/menu$"))
+        @self.bot.on_message(private & regex("^/menu$") & self.throttled("/menu"))
         async def show_menu(client: Client, message: Message):
             menu_text = """
 🎮 **منوی اصلی بازی استراتژیک**
@@ -373,7 +941,7 @@ class AdvancedStrategicGameBot:
             await message.reply(menu_text, reply_markup=self.create_main_menu_inline_keyboard())
 
         # هندلر کال‌بک‌ها
-        @self.bot.on_callback_query()
+        @self.bot.on_callback_query(self.throttled())
         async def handle_callbacks(client: Client, callback_query: CallbackQuery):
             user_id = callback_query.from_user.id
             data = callback_query.data
@@ -387,22 +955,61 @@ class AdvancedStrategicGameBot:
                 await self.show_city_management(callback_query)
             elif data == "city_buildings":
                 await self.show_buildings_menu(callback_query)
+            elif data == "city_population":
+                await self.show_city_report(callback_query, "population")
+            elif data == "city_income":
+                await self.show_city_report(callback_query, "income")
+            elif data == "city_defense":
+                await self.show_city_report(callback_query, "defense")
+            elif data == "city_stats":
+                await self.show_city_report(callback_query, "stats")
+            elif data.startswith("city_tax_"):
+                await self.set_tax_rate(callback_query, int(data[len("city_tax_"):]))
             elif data == "upgrade_city":
                 await self.upgrade_city(callback_query)
+            elif data == "confirm_upgrade":
+                await self.confirm_city_upgrade(callback_query)
             
             # مدیریت ارتش
             elif data == "train_infantry":
                 await self.train_troops(callback_query, "infantry")
             elif data == "train_archers":
                 await self.train_troops(callback_query, "archers")
+            elif data == "train_cavalry":
+                await self.train_troops(callback_query, "cavalry")
+            elif data == "train_siege":
+                await self.train_troops(callback_query, "siege")
+            elif data.startswith("train_") and data.rsplit("_", 1)[1].isdigit():
+                unit_type, count = data[len("train_"):].rsplit("_", 1)
+                await self.confirm_training(callback_query, unit_type, int(count))
+            elif data == "direct_attack":
+                await self.choose_attack_target(callback_query)
             elif data == "attack_menu":
                 await self.show_attack_menu(callback_query)
+            elif data == "search_enemy":
+                await self.show_enemy_search(callback_query)
+            
+            # تحقیقات
+            elif data == "research_menu":
+                await self.show_research_menu(callback_query)
+            elif data.startswith("research_"):
+                await self.start_research(callback_query, data[len("research_"):])
             
             # اقدامات سریع
             elif data == "collect_resources":
                 await self.collect_resources(callback_query)
             elif data == "daily_reward":
-                await self.claim_daily_reward(callback_query)
+                await self.claim_reward(callback_query, "daily")
+            elif data == "weekly_reward":
+                await self.claim_reward(callback_query, "weekly")
+            elif data == "tournaments":
+                await self.show_tournaments(callback_query)
+            elif data == "tournament_join":
+                await self.join_tournament(callback_query)
+            elif data == "spy_enemies":
+                await self.show_spy_report(callback_query)
+            elif data.startswith("spy_player_"):
+                await self.show_spy_report(callback_query, int(data[len("spy_player_"):]))
             
             # سایر کال‌بک‌ها
             elif data == "player_profile":
@@ -485,20 +1092,23 @@ class AdvancedStrategicGameBot:
             "cavalry": "🐎 سواره نظام",
             "siege": "♟️ سلاح‌های محاصره"
         }
+        production, attack, build_speed = await self.get_modifiers(callback_query.from_user.id)
+        costs = UNIT_TRAINING_COST[unit_type]
+        self.set_session(callback_query.from_user.id, SESSION_TRAIN_COUNT, (unit_type,))
         
         training_text = f"""
 ⚔️ **آموزش {unit_names[unit_type]}**
 
 🎯 **اطلاعات واحد:**
-• ⚔️ قدرت حمله: {random.randint(15, 25)}
+• ⚔️ قدرت حمله: {int(random.randint(15, 25) * attack)}
 • 🛡️ قدرت دفاع: {random.randint(10, 20)}
 • 🎯 دقت: {random.randint(70, 90)}%
 • ⏱️ زمان آموزش: 30 دقیقه
 
-💰 **هزینه‌ها:**
-• 🥇 طلا: {random.randint(50, 100)}
-• 🌾 غذا: {random.randint(20, 50)}
-• ⚙️ آهن: {random.randint(10, 30)}
+💰 **هزینه هر واحد:**
+• 🥇 طلا: {costs['gold']}
+• 🌾 غذا: {costs['food']}
+• ⚙️ آهن: {costs['iron']}
 
 🔢 **تعداد مورد نظر برای آموزش را انتخاب کنید:**
         """
@@ -520,12 +1130,13 @@ class AdvancedStrategicGameBot:
 
     async def collect_resources(self, callback_query: CallbackQuery):
         """جمع‌آوری منابع"""
+        production, attack, build_speed = await self.get_modifiers(callback_query.from_user.id)
         collected = {
-            'gold': random.randint(100, 300),
-            'food': random.randint(200, 500),
-            'wood': random.randint(150, 400),
-            'stone': random.randint(100, 250),
-            'iron': random.randint(50, 150)
+            'gold': int(random.randint(100, 300) * production),
+            'food': int(random.randint(200, 500) * production),
+            'wood': int(random.randint(150, 400) * production),
+            'stone': int(random.randint(100, 250) * production),
+            'iron': int(random.randint(50, 150) * production)
         }
         
         collection_text = f"""
@@ -551,21 +1162,24 @@ class AdvancedStrategicGameBot:
         
         await callback_query.message.edit_text(collection_text, reply_markup=keyboard)
 
-    async def claim_daily_reward(self, callback_query: CallbackQuery):
-        """دریافت پاداش روزانه"""
-        rewards = {
-            'gold': random.randint(500, 1000),
-            'food': random.randint(800, 1500),
-            'wood': random.randint(600, 1200),
-            'stone': random.randint(400, 800),
-            'iron': random.randint(200, 500),
-            'mana': random.randint(50, 150)
-        }
+    async def claim_reward(self, callback_query: CallbackQuery, reward_type: str):
+        """دریافت پاداش روزانه یا هفتگی"""
+        user_id = callback_query.from_user.id
+        claimed, rewards, streak = await self.grant_reward(user_id, reward_type)
+        period_name = "روزانه" if reward_type == "daily" else "هفتگی"
+        next_time = "فردا" if reward_type == "daily" else "هفته بعد"
         
-        reward_text = f"""
-🎁 **پاداش روزانه دریافت شد!**
+        if rewards is None:
+            reward_text = f"""
+🎁 **پاداش {period_name}**
 
-🎉 **مبارک! امروز این پاداش‌ها را دریافت کردید:**
+⚠️ **ابتدا با /start در بازی ثبت نام کنید.**
+            """
+        elif claimed:
+            reward_text = f"""
+🎁 **پاداش {period_name} دریافت شد!**
+
+🎉 **مبارک! این پاداش‌ها را دریافت کردید:**
 • 🥇 طلا: {rewards['gold']:,}
 • 🌾 غذا: {rewards['food']:,}
 • 🪵 چوب: {rewards['wood']:,}
@@ -573,16 +1187,395 @@ class AdvancedStrategicGameBot:
 • ⚙️ آهن: {rewards['iron']:,}
 • 🔮 مانا: {rewards['mana']:,}
 
-⭐ **فردا پاداش بهتری در انتظار شماست!**
+🔥 **زنجیره: {streak}**
+⭐ **{next_time} پاداش بهتری در انتظار شماست!**
+            """
+        else:
+            reward_text = f"""
+🎁 **پاداش {period_name}**
+
+✅ **پاداش این دوره را قبلاً دریافت کرده‌اید.**
+
+🔥 **زنجیره: {streak}**
+⏱️ **پاداش بعدی: {next_time}**
+            """
+        
+        keyboard = InlineKeyboard()
+        if reward_type == "daily":
+            keyboard.row(
+                ("📅 پاداش هفتگی", "weekly_reward"),
+                ("🔙 اقدامات سریع", "quick_actions")
+            )
+        else:
+            keyboard.row(
+                ("🎁 پاداش روزانه", "daily_reward"),
+                ("🔙 اقدامات سریع", "quick_actions")
+            )
+        
+        await callback_query.message.edit_text(reward_text, reply_markup=keyboard)
+
+    async def show_enemy_search(self, callback_query: CallbackQuery):
+        """جستجوی دشمن ضعیف در نزدیکی بازیکن"""
+        user_id = callback_query.from_user.id
+        target_id = await self.find_weak_target(user_id)
+        
+        keyboard = InlineKeyboard()
+        if target_id is None:
+            search_text = """
+🔍 **جستجوی دشمن**
+
+🌫️ **هیچ دشمن ضعیفی در نزدیکی شما پیدا نشد.**
+⏱️ **کمی بعد دوباره جستجو کنید.**
+            """
+        else:
+            report = await self.get_spy_report(target_id)
+            search_text = f"""
+🔍 **دشمن پیدا شد!**
+
+👤 **فرمانده:** {report['name']}
+🎯 **سطح:** {report['level']}
+📍 **مختصات:** X: {report['position_x']}, Y: {report['position_y']}
+
+🕵️ **برای اطلاعات بیشتر جاسوس بفرستید.**
+            """
+            keyboard.row(
+                ("🕵️ جاسوسی", f"spy_player_{target_id}"),
+                ("🔄 جستجوی دیگر", "search_enemy")
+            )
+        keyboard.row(
+            ("🔙 منوی حمله", "attack_menu")
+        )
+        
+        await callback_query.message.edit_text(search_text, reply_markup=keyboard)
+
+    async def show_spy_report(self, callback_query: CallbackQuery, target_id: Optional[int] = None):
+        """نمایش گزارش جاسوسی از یک دشمن"""
+        if target_id is None:
+            target_id = await self.find_weak_target(callback_query.from_user.id)
+        report = await self.get_spy_report(target_id) if target_id is not None else None
+        
+        keyboard = InlineKeyboard()
+        if report is None:
+            spy_text = """
+🕵️ **جاسوسی**
+
+🌫️ **جاسوسان شما هدفی پیدا نکردند.**
+            """
+        else:
+            spy_text = f"""
+🕵️ **گزارش جاسوسی: {report['name']}**
+
+🏰 **شهر {report['city_name']}:**
+• 📍 مختصات: X: {report['position_x']}, Y: {report['position_y']}
+• 👥 جمعیت: {report['population']:,}
+• 🛡️ دفاع: {report['defense']:,}
+
+⚔️ **ارتش:** {report['army']:,}
+
+💎 **منابع:**
+• 🥇 طلا: {report['gold']:,}
+• 🌾 غذا: {report['food']:,}
+• 🪵 چوب: {report['wood']:,}
+• 🪨 سنگ: {report['stone']:,}
+• ⚙️ آهن: {report['iron']:,}
+            """
+            keyboard.row(
+                ("🔍 جستجوی دشمن", "search_enemy"),
+                ("⚔️ منوی حمله", "attack_menu")
+            )
+        keyboard.row(
+            ("🔙 اقدامات سریع", "quick_actions")
+        )
+        
+        await callback_query.message.edit_text(spy_text, reply_markup=keyboard)
+
+    async def build_research_menu(self, user_id: int):
+        """ساخت متن و کیبورد منوی تحقیقات"""
+        production, attack, build_speed = await self.get_modifiers(user_id)
+        status = self.get_research_status(user_id)
+        
+        lines = []
+        keyboard = InlineKeyboard()
+        buttons = []
+        for tech_id, tech in TECH_TREE.items():
+            state = status.get(tech_id)
+            if state == 'completed':
+                lines.append(f"• ✅ {tech['name']}")
+            elif state is not None:
+                lines.append(f"• ⏳ {tech['name']} (پایان: {state[11:16]})")
+            elif all(status.get(required) == 'completed' for required in tech['requires']):
+                lines.append(f"• 🔓 {tech['name']} - 🔮 {tech['cost']} مانا، ⏱️ {tech['hours']} ساعت")
+                buttons.append((tech['name'], f"research_{tech_id}"))
+            else:
+                lines.append(f"• 🔒 {tech['name']}")
+        
+        for i in range(0, len(buttons), 2):
+            keyboard.row(*buttons[i:i + 2])
+        keyboard.row(
+            ("🔙 منوی اصلی", "main_menu")
+        )
+        
+        tech_lines = "\n".join(lines)
+        research_text = f"""
+🔮 **تحقیقات و تکنولوژی**
+
+📈 **ضرایب فعلی:**
+• ⛏️ تولید: ×{production:.2f}
+• ⚔️ حمله: ×{attack:.2f}
+• 🏗️ سرعت ساخت: ×{build_speed:.2f}
+
+🧪 **درخت تحقیقات:**
+{tech_lines}
+        """
+        return research_text, keyboard
+
+    async def show_research_menu(self, callback_query: CallbackQuery):
+        """نمایش منوی تحقیقات"""
+        research_text, keyboard = await self.build_research_menu(callback_query.from_user.id)
+        await callback_query.message.edit_text(research_text, reply_markup=keyboard)
+
+    async def start_research(self, callback_query: CallbackQuery, tech_id: str):
+        """شروع تحقیق یک تکنولوژی"""
+        user_id = callback_query.from_user.id
+        error = await self.begin_research(user_id, tech_id)
+        if error is None:
+            tech = TECH_TREE[tech_id]
+            result_text = f"""
+🔮 **تحقیق {tech['name']} شروع شد!**
+
+⏱️ **زمان تحقیق: {tech['hours']} ساعت**
+🔮 **مانای مصرف‌شده: {tech['cost']}**
+            """
+        else:
+            result_text = f"🔮 **تحقیقات**\n\n⚠️ {error}"
+        
+        keyboard = InlineKeyboard()
+        keyboard.row(
+            ("🔙 تحقیقات", "research_menu")
+        )
+        await callback_query.message.edit_text(result_text, reply_markup=keyboard)
+
+    async def show_tournaments(self, callback_query: CallbackQuery):
+        """نمایش مسابقه فعلی"""
+        user_id = callback_query.from_user.id
+        tournament_id = self.get_open_tournament()
+        self.cursor.execute(
+            'SELECT COUNT(*), SUM(user_id = ?) FROM tournament_entries WHERE tournament_id = ?',
+            (user_id, tournament_id)
+        )
+        entrants, joined = self.cursor.fetchone()
+        
+        tournament_text = f"""
+🏆 **مسابقات**
+
+🎯 **مسابقه شماره {tournament_id}**
+• 👥 شرکت‌کنندگان: {entrants:,} از {TOURNAMENT_SIZE:,}
+• ⚔️ نوع: حذفی
+
+⏱️ **مسابقه با تکمیل ظرفیت به صورت خودکار شروع می‌شود.**
         """
         
         keyboard = InlineKeyboard()
+        if not joined:
+            keyboard.row(
+                ("✅ ثبت نام", "tournament_join")
+            )
         keyboard.row(
-            ("📅 پاداش هفتگی", "weekly_reward"),
             ("🔙 اقدامات سریع", "quick_actions")
         )
         
-        await callback_query.message.edit_text(reward_text, reply_markup=keyboard)
+        await callback_query.message.edit_text(tournament_text, reply_markup=keyboard)
+
+    async def join_tournament(self, callback_query: CallbackQuery):
+        """ثبت نام در مسابقه فعلی"""
+        user_id = callback_query.from_user.id
+        tournament_id = self.get_open_tournament()
+        production, attack, build_speed = await self.get_modifiers(user_id)
+        
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO tournament_entries (tournament_id, user_id, power)
+            SELECT ?, user_id, CAST(army * ? AS INTEGER) FROM players WHERE user_id = ?
+        ''', (tournament_id, attack, user_id))
+        keyboard = InlineKeyboard()
+        keyboard.row(
+            ("🏆 مسابقات", "tournaments"),
+            ("🔙 اقدامات سریع", "quick_actions")
+        )
+        if self.cursor.rowcount == 0:
+            # یا بازیکن ثبت نشده یا قبلاً در همین مسابقه ثبت نام کرده است
+            self.conn.rollback()
+            self.cursor.execute('SELECT 1 FROM players WHERE user_id = ?', (user_id,))
+            if self.cursor.fetchone() is None:
+                join_text = "⚠️ **ابتدا با /start در بازی ثبت نام کنید.**"
+            else:
+                join_text = "🏆 **شما قبلاً در این مسابقه ثبت نام کرده‌اید.**\n\n📨 نتیجه نبردها برای شما ارسال می‌شود."
+            await callback_query.message.edit_text(join_text, reply_markup=keyboard)
+            return
+        
+        self.cursor.execute(
+            'SELECT COUNT(*) FROM tournament_entries WHERE tournament_id = ?',
+            (tournament_id,)
+        )
+        if self.cursor.fetchone()[0] >= TOURNAMENT_SIZE:
+            # بستن ثبت نام پیش از شروع تا مسابقه دوبار اجرا نشود
+            self.cursor.execute(
+                "UPDATE tournaments SET status = 'running' WHERE id = ? AND status = 'registration'",
+                (tournament_id,)
+            )
+            if self.cursor.rowcount:
+                self.start_background_task(self.run_tournament(tournament_id))
+        self.conn.commit()
+        
+        await callback_query.message.edit_text(
+            "🏆 **ثبت نام شما در مسابقه انجام شد!**\n\n📨 نتیجه نبردها برای شما ارسال می‌شود.",
+            reply_markup=keyboard
+        )
+
+    async def confirm_training(self, callback_query: CallbackQuery, unit_type: str, count: int):
+        """آموزش تعداد انتخاب‌شده از یک واحد"""
+        user_id = callback_query.from_user.id
+        session = self.get_session(user_id)
+        keyboard = InlineKeyboard()
+        keyboard.row(
+            ("🔙 مدیریت ارتش", "army_management")
+        )
+        
+        if session != (SESSION_TRAIN_COUNT, (unit_type,)):
+            await callback_query.message.edit_text(
+                "⏱️ **زمان انتخاب تمام شده است.** دوباره از منوی ارتش اقدام کنید.",
+                reply_markup=keyboard
+            )
+            return
+        
+        costs = {
+            resource: amount * count
+            for resource, amount in UNIT_TRAINING_COST[unit_type].items()
+        }
+        if self.spend_resources(user_id, costs):
+            self.cursor.execute(
+                'UPDATE players SET army = army + ? WHERE user_id = ?',
+                (count, user_id)
+            )
+            self.conn.commit()
+            self.clear_session(user_id)
+            self.invalidate_spy_report(user_id)
+            training_text = f"✅ **آموزش {count:,} واحد آغاز شد!**\n\n💰 طلا: {costs['gold']:,} • 🌾 غذا: {costs['food']:,} • ⚙️ آهن: {costs['iron']:,}"
+        else:
+            self.conn.rollback()
+            training_text = "⚠️ **منابع کافی برای این تعداد ندارید.** تعداد کمتری انتخاب کنید."
+        
+        await callback_query.message.edit_text(training_text, reply_markup=keyboard)
+
+    async def choose_attack_target(self, callback_query: CallbackQuery):
+        """شروع انتخاب هدف برای حمله مستقیم"""
+        self.set_session(callback_query.from_user.id, SESSION_ATTACK_TARGET)
+        
+        keyboard = InlineKeyboard()
+        keyboard.row(
+            ("🔙 منوی حمله", "attack_menu")
+        )
+        await callback_query.message.edit_text(
+            "🎯 **حمله مستقیم**\n\n🆔 **شناسه بازیکن مورد نظر را ارسال کنید:**",
+            reply_markup=keyboard
+        )
+
+    async def confirm_city_upgrade(self, callback_query: CallbackQuery):
+        """انجام ارتقاء شهر پس از تایید"""
+        user_id = callback_query.from_user.id
+        keyboard = InlineKeyboard()
+        keyboard.row(
+            ("🔙 مدیریت شهر", "city_management")
+        )
+        
+        session = self.get_session(user_id)
+        if session is None or session[0] != SESSION_UPGRADE_CONFIRM:
+            await callback_query.message.edit_text(
+                "⏱️ **زمان تایید تمام شده است.** دوباره ارتقاء را انتخاب کنید.",
+                reply_markup=keyboard
+            )
+            return
+        
+        # مدتی که به کاربر نشان داده شد همان مدتی است که اعمال می‌شود
+        upgrade_minutes = session[1][0]
+        self.settle_city(user_id)
+        if not self.spend_resources(user_id, CITY_UPGRADE_COST):
+            self.conn.rollback()
+            upgrade_text = "⚠️ **منابع کافی برای ارتقاء شهر ندارید.**"
+        else:
+            self.cursor.execute('''
+                UPDATE cities SET upgrade_finish_time = ?
+                WHERE id = (SELECT MIN(id) FROM cities WHERE user_id = ?)
+                  AND upgrade_finish_time IS NULL
+            ''', (
+                (datetime.datetime.now() + datetime.timedelta(minutes=upgrade_minutes)).isoformat(),
+                user_id
+            ))
+            if self.cursor.rowcount == 0:
+                # شهری نیست یا ارتقاء دیگری در جریان است؛ منابع برگردانده می‌شوند
+                self.conn.rollback()
+                upgrade_text = "⚠️ **شهری برای ارتقاء ندارید یا ارتقاء دیگری در جریان است.**"
+            else:
+                self.conn.commit()
+                self.invalidate_spy_report(user_id)
+                upgrade_text = f"✅ **ارتقاء شهر آغاز شد!** 🏗️\n\n⏱️ پایان ارتقاء تا {upgrade_minutes} دقیقه دیگر"
+            self.clear_session(user_id)
+        
+        await callback_query.message.edit_text(upgrade_text, reply_markup=keyboard)
+
+    async def show_city_report(self, callback_query: CallbackQuery, report_type: str):
+        """نمایش گزارش جمعیت، درآمد، دفاع یا آمار شهر"""
+        city_info = await self.get_city_info(callback_query.from_user.id)
+        keyboard = InlineKeyboard()
+        
+        if report_type == "population":
+            report_text = f"""
+👥 **جمعیت شهر {city_info['name']}**
+
+• 👥 جمعیت فعلی: {city_info['population']:,}
+• 🏠 ظرفیت مسکن: {city_info['capacity']:,}
+• 🌾 تامین غذا: {city_info['food_ratio']:.0%}
+• 😊 رضایت: {city_info['happiness']}%
+
+🏠 **برای افزایش ظرفیت خانه بسازید.**
+            """
+        elif report_type == "income":
+            report_text = f"""
+💰 **درآمد شهر {city_info['name']}**
+
+• 📜 مالیات: {city_info['tax_rate']}%
+• 🥇 درآمد ساعتی: {city_info['income']:,} طلا
+• 😊 رضایت: {city_info['happiness']}%
+
+⚠️ **مالیات بیشتر رضایت مردم را کم می‌کند.**
+            """
+            keyboard.row(*(
+                (f"📜 {rate}%", f"city_tax_{rate}") for rate in TAX_RATES
+            ))
+        elif report_type == "defense":
+            report_text = f"""
+🛡️ **دفاع شهر {city_info['name']}**
+
+• 🛡️ قدرت دفاع: {city_info['defense']:,}
+• 🎯 سطح شهر: {city_info['level']}
+
+🏰 **برای تقویت دفاع دیوار بسازید.**
+            """
+        else:
+            report_text = f"""
+📊 **آمار شهر {city_info['name']}**
+
+• 🎯 سطح: {city_info['level']}
+• 👥 جمعیت: {city_info['population']:,} از {city_info['capacity']:,}
+• 😊 رضایت: {city_info['happiness']}%
+• 🛡️ دفاع: {city_info['defense']:,}
+• 📜 مالیات: {city_info['tax_rate']}%
+• 🥇 درآمد ساعتی: {city_info['income']:,}
+            """
+        
+        keyboard.row(
+            ("🔙 مدیریت شهر", "city_management")
+        )
+        await callback_query.message.edit_text(report_text, reply_markup=keyboard)
 
     def create_main_menu_inline_keyboard(self):
         """ایجاد کیبورد اینلاین برای منوی اصلی"""
@@ -632,7 +1625,31 @@ class AdvancedStrategicGameBot:
 
     async def upgrade_city(self, callback_query: CallbackQuery):
         """ارتقاء شهر"""
-        upgrade_text = """
+        user_id = callback_query.from_user.id
+        self.settle_city(user_id)
+        self.cursor.execute(
+            'SELECT upgrade_finish_time FROM cities WHERE user_id = ? ORDER BY id LIMIT 1',
+            (user_id,)
+        )
+        row = self.cursor.fetchone()
+        if row and row[0] is not None:
+            keyboard = InlineKeyboard()
+            keyboard.row(
+                ("🔙 مدیریت شهر", "city_management")
+            )
+            remaining = datetime.datetime.fromisoformat(row[0]) - datetime.datetime.now()
+            remaining = max(1, math.ceil(remaining.total_seconds() / 60))
+            await callback_query.message.edit_text(
+                f"🏗️ **ارتقاء شهر در جریان است.**\n\n⏱️ زمان باقی‌مانده: {remaining} دقیقه",
+                reply_markup=keyboard
+            )
+            return
+        
+        production, attack, build_speed = await self.get_modifiers(user_id)
+        upgrade_minutes = round(CITY_UPGRADE_MINUTES / build_speed)
+        self.set_session(user_id, SESSION_UPGRADE_CONFIRM, (upgrade_minutes,))
+        
+        upgrade_text = f"""
 ⚡ **ارتقاء شهر**
 
 🏰 **ارتقاء به سطح بعدی:**
@@ -642,12 +1659,12 @@ class AdvancedStrategicGameBot:
 • 🏗️ باز شدن ساختمان‌های جدید
 
 💰 **هزینه ارتقاء:**
-• 🥇 طلا: 5,000
-• 🪵 چوب: 3,000
-• 🪨 سنگ: 2,000
-• ⚙️ آهن: 1,000
+• 🥇 طلا: {CITY_UPGRADE_COST['gold']:,}
+• 🪵 چوب: {CITY_UPGRADE_COST['wood']:,}
+• 🪨 سنگ: {CITY_UPGRADE_COST['stone']:,}
+• ⚙️ آهن: {CITY_UPGRADE_COST['iron']:,}
 
-⏱️ **زمان ارتقاء: 2 ساعت**
+⏱️ **زمان ارتقاء: {upgrade_minutes} دقیقه**
         """
         
         keyboard = InlineKeyboard()
@@ -803,24 +1820,70 @@ class AdvancedStrategicGameBot:
                 user_info.last_name,
                 datetime.datetime.now().isoformat()
             ))
+            # شهر پایتخت در یک موقعیت تصادفی روی نقشه، اگر بازیکن هنوز شهری ندارد
+            self.cursor.execute('''
+                INSERT INTO cities (user_id, city_name, position_x, position_y, last_update_time)
+                SELECT ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM cities WHERE user_id = ?)
+            ''', (
+                user_id, 'شهر اصلی', random.randrange(MAP_SIZE), random.randrange(MAP_SIZE),
+                time.time(), user_id
+            ))
             self.conn.commit()
             logger.info(f"بازیکن جدید ثبت شد: {user_id}")
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"خطا در ثبت بازیکن: {e}")
 
     async def get_city_info(self, user_id: int) -> Dict:
         """دریافت اطلاعات شهر"""
+        self.settle_city(user_id)
+        self.cursor.execute('''
+            SELECT c.city_name, c.level, c.population, c.happiness, c.defense, c.tax_rate,
+                   p.gold, p.food, p.wood, p.stone, p.iron,
+                   COALESCE((SELECT SUM(level) FROM buildings
+                             WHERE city_id = c.id AND building_type = 'houses'), 0)
+            FROM cities c
+            JOIN players p ON p.user_id = c.user_id
+            WHERE c.user_id = ?
+            ORDER BY c.id
+            LIMIT 1
+        ''', (user_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return {
+                'name': 'شهر اصلی',
+                'level': 1,
+                'population': 2000,
+                'happiness': 85,
+                'defense': 200,
+                'tax_rate': 10,
+                'capacity': CITY_BASE_HOUSING + HOUSING_PER_CITY_LEVEL,
+                'food_ratio': 1.0,
+                'income': int(2000 * 10 / 100 * INCOME_PER_CITIZEN),
+                'gold': 2000,
+                'food': 1000,
+                'wood': 800,
+                'stone': 600,
+                'iron': 400
+            }
+        
+        name, level, population, happiness, defense, tax_rate, gold, food, wood, stone, iron, houses = row
         return {
-            'name': 'شهر اصلی',
-            'level': 1,
-            'population': 2000,
-            'happiness': 85,
-            'defense': 200,
-            'gold': 2000,
-            'food': 1000,
-            'wood': 800,
-            'stone': 600,
-            'iron': 400
+            'name': name,
+            'level': level,
+            'population': population,
+            'happiness': happiness,
+            'defense': defense,
+            'tax_rate': tax_rate,
+            'capacity': CITY_BASE_HOUSING + HOUSING_PER_CITY_LEVEL * level + HOUSING_PER_HOUSE_LEVEL * houses,
+            'food_ratio': min(food / max(population * FOOD_PER_CITIZEN_DAY, 1), 1.0),
+            'income': int(population * tax_rate / 100 * INCOME_PER_CITIZEN),
+            'gold': gold,
+            'food': food,
+            'wood': wood,
+            'stone': stone,
+            'iron': iron
         }
 
     async def get_army_info(self, user_id: int) -> Dict:
@@ -850,6 +1913,876 @@ class AdvancedStrategicGameBot:
             'total_battles': 0
         }
 
+    # متدهای پاداش
+    def get_reward_periods(self, reward_type: str, now: Optional[datetime.datetime] = None):
+        """کلید دوره فعلی و دوره قبلی پاداش (تاریخ روز یا هفته ISO)"""
+        now = now or datetime.datetime.now()
+        if reward_type == 'daily':
+            current = now.date()
+            previous = current - datetime.timedelta(days=1)
+            return current.isoformat(), previous.isoformat()
+        previous = now - datetime.timedelta(weeks=1)
+        return now.strftime('%G-W%V'), previous.strftime('%G-W%V')
+
+    async def grant_reward(self, user_id: int, reward_type: str):
+        """ثبت و پرداخت پاداش به صورت idempotent
+
+        توکن دریافت از بازیکن و دوره ساخته می‌شود، پس لمس دوباره دکمه همان
+        ردیف را هدف می‌گیرد و پاداش دوم پرداخت نمی‌شود. زنجیره با یک UPSERT
+        و مقایسه با دوره قبلی محاسبه می‌شود و نیازی به پیمایش همه بازیکنان نیست.
+        """
+        period, previous_period = self.get_reward_periods(reward_type)
+        claim_token = f"{reward_type}:{user_id}:{period}"
+        
+        try:
+            self.cursor.execute('''
+                INSERT OR IGNORE INTO reward_claims
+                (claim_token, user_id, reward_type, period, claimed_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (claim_token, user_id, reward_type, period, datetime.datetime.now().isoformat()))
+            
+            if self.cursor.rowcount == 0:
+                self.conn.rollback()
+                self.cursor.execute('''
+                    SELECT c.rewards, s.streak FROM reward_claims c
+                    LEFT JOIN reward_streaks s ON s.user_id = c.user_id AND s.reward_type = c.reward_type
+                    WHERE c.claim_token = ?
+                ''', (claim_token,))
+                rewards, streak = self.cursor.fetchone()
+                return False, json.loads(rewards) if rewards else {}, streak or 0
+            
+            self.cursor.execute('''
+                INSERT INTO reward_streaks (user_id, reward_type, last_period, streak)
+                VALUES (?, ?, ?, 1)
+                ON CONFLICT (user_id, reward_type) DO UPDATE SET
+                    streak = CASE WHEN last_period = ? THEN streak + 1 ELSE 1 END,
+                    last_period = excluded.last_period
+            ''', (user_id, reward_type, period, previous_period))
+            self.cursor.execute(
+                'SELECT streak FROM reward_streaks WHERE user_id = ? AND reward_type = ?',
+                (user_id, reward_type)
+            )
+            streak = self.cursor.fetchone()[0]
+            
+            multiplier = 1 + REWARD_STREAK_BONUS * (min(streak, REWARD_STREAK_CAP) - 1)
+            rewards = {
+                resource: int(amount * multiplier)
+                for resource, amount in REWARD_TABLES[reward_type].items()
+            }
+            
+            self.cursor.execute(
+                'UPDATE reward_claims SET rewards = ? WHERE claim_token = ?',
+                (json.dumps(rewards), claim_token)
+            )
+            self.cursor.execute('''
+                UPDATE players SET gold = gold + ?, food = food + ?, wood = wood + ?,
+                    stone = stone + ?, iron = iron + ?, mana = mana + ?
+                WHERE user_id = ?
+            ''', (
+                rewards['gold'], rewards['food'], rewards['wood'],
+                rewards['stone'], rewards['iron'], rewards['mana'], user_id
+            ))
+            if self.cursor.rowcount == 0:
+                # بازیکن ثبت نشده؛ توکن این دوره نباید مصرف شود
+                self.conn.rollback()
+                return False, None, 0
+            self.conn.commit()
+            self.invalidate_spy_report(user_id)
+            return True, rewards, streak
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"خطا در پرداخت پاداش: {e}")
+            raise
+
+    async def reset_expired_streaks(self):
+        """صفر کردن زنجیره‌های منقضی شده با یک دستور SQL"""
+        for reward_type in REWARD_TABLES:
+            _, previous_period = self.get_reward_periods(reward_type)
+            self.cursor.execute('''
+                UPDATE reward_streaks SET streak = 0
+                WHERE reward_type = ? AND last_period < ? AND streak > 0
+            ''', (reward_type, previous_period))
+        self.conn.commit()
+
+    # متدهای تحقیقات
+    def get_research_status(self, user_id: int) -> Dict:
+        """وضعیت تحقیقات بازیکن: 'completed' یا زمان پایان"""
+        self.cursor.execute(
+            'SELECT tech_id, finish_time, completed FROM research WHERE user_id = ?',
+            (user_id,)
+        )
+        return {
+            tech_id: 'completed' if completed else finish_time
+            for tech_id, finish_time, completed in self.cursor.fetchall()
+        }
+
+    async def begin_research(self, user_id: int, tech_id: str) -> Optional[str]:
+        """ثبت تحقیق جدید؛ در صورت خطا پیام خطا برگردانده می‌شود"""
+        tech = TECH_TREE.get(tech_id)
+        if tech is None:
+            return "این تکنولوژی وجود ندارد."
+        
+        await self.get_modifiers(user_id)
+        status = self.get_research_status(user_id)
+        if tech_id in status:
+            return "این تکنولوژی قبلاً تحقیق شده یا در حال تحقیق است."
+        if any(state != 'completed' for state in status.values()):
+            return "یک تحقیق دیگر در حال انجام است."
+        if any(status.get(required) != 'completed' for required in tech['requires']):
+            return "پیش‌نیازهای این تکنولوژی کامل نشده است."
+        
+        try:
+            self.cursor.execute(
+                'UPDATE players SET mana = mana - ? WHERE user_id = ? AND mana >= ?',
+                (tech['cost'], user_id, tech['cost'])
+            )
+            if self.cursor.rowcount == 0:
+                self.conn.rollback()
+                return "مانای کافی ندارید."
+            
+            finish_time = datetime.datetime.now() + datetime.timedelta(hours=tech['hours'])
+            self.cursor.execute(
+                'INSERT INTO research (user_id, tech_id, finish_time) VALUES (?, ?, ?)',
+                (user_id, tech_id, finish_time.isoformat())
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"خطا در شروع تحقیق: {e}")
+            return "خطا در شروع تحقیق."
+        
+        self.modifier_cache.pop(user_id, None)
+        return None
+
+    async def get_modifiers(self, user_id: int) -> tuple:
+        """بردار ضرایب (تولید، حمله، سرعت ساخت) بازیکن
+
+        ضرایب فقط وقتی تحقیقی تمام می‌شود دوباره محاسبه و ذخیره می‌شوند؛ در
+        بقیه فراخوانی‌ها بردار کش‌شده تا زمان پایان تحقیق بعدی برگردانده می‌شود.
+        """
+        now = datetime.datetime.now().isoformat()
+        cached = self.modifier_cache.get(user_id)
+        if cached and (cached[1] is None or now < cached[1]):
+            self.modifier_cache.move_to_end(user_id)
+            return cached[0]
+        
+        # فقط وقتی تحقیقی واقعاً تمام شده می‌نویسیم تا تراکنشی باز نماند
+        self.cursor.execute(
+            'SELECT MIN(finish_time) FROM research WHERE user_id = ? AND completed = FALSE',
+            (user_id,)
+        )
+        next_finish = self.cursor.fetchone()[0]
+        if next_finish is not None and next_finish <= now:
+            # تحقیق جدیدی تمام شده؛ بردار یکبار از روی درخت محاسبه و ذخیره می‌شود
+            self.cursor.execute('''
+                UPDATE research SET completed = TRUE
+                WHERE user_id = ? AND completed = FALSE AND finish_time <= ?
+            ''', (user_id, now))
+            self.cursor.execute(
+                'SELECT tech_id FROM research WHERE user_id = ? AND completed = TRUE',
+                (user_id,)
+            )
+            vector = [1.0] * len(MODIFIER_KEYS)
+            for (tech_id,) in self.cursor.fetchall():
+                for i, effect in enumerate(self.tech_effects.get(tech_id, ())):
+                    vector[i] += effect
+            modifiers = tuple(vector)
+            self.cursor.execute('''
+                INSERT OR REPLACE INTO player_modifiers (user_id, production, attack, build_speed)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, *modifiers))
+            self.conn.commit()
+            
+            self.cursor.execute(
+                'SELECT MIN(finish_time) FROM research WHERE user_id = ? AND completed = FALSE',
+                (user_id,)
+            )
+            next_finish = self.cursor.fetchone()[0]
+        elif cached is not None:
+            modifiers = cached[0]
+        else:
+            self.cursor.execute(
+                'SELECT production, attack, build_speed FROM player_modifiers WHERE user_id = ?',
+                (user_id,)
+            )
+            modifiers = tuple(self.cursor.fetchone() or (1.0,) * len(MODIFIER_KEYS))
+        
+        self.modifier_cache[user_id] = (modifiers, next_finish)
+        self.modifier_cache.move_to_end(user_id)
+        if len(self.modifier_cache) > MODIFIER_CACHE_SIZE:
+            self.modifier_cache.popitem(last=False)
+        return modifiers
+
+    # متدهای مسابقات
+    def start_background_task(self, coroutine):
+        """اجرای یک کار پس‌زمینه و نگه داشتن ارجاع به آن تا پایان"""
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        task.add_done_callback(self._log_task_failure)
+        return task
+
+    def _log_task_failure(self, task: asyncio.Task):
+        """ثبت خطای کار پس‌زمینه تا شکست آن تا راه‌اندازی بعدی پنهان نماند"""
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(
+                f"کار پس‌زمینه {task.get_coro().__qualname__} با خطا متوقف شد: {error!r}",
+                exc_info=error
+            )
+
+    def get_open_tournament(self) -> int:
+        """شناسه مسابقه در حال ثبت نام (در صورت نبود ساخته می‌شود)"""
+        self.cursor.execute(
+            "SELECT id FROM tournaments WHERE status = 'registration' ORDER BY id DESC LIMIT 1"
+        )
+        row = self.cursor.fetchone()
+        if row:
+            return row[0]
+        self.cursor.execute(
+            'INSERT INTO tournaments (created_at) VALUES (?)',
+            (datetime.datetime.now().isoformat(),)
+        )
+        self.conn.commit()
+        return self.cursor.lastrowid
+
+    def create_battle_pool(self) -> ProcessPoolExecutor:
+        """ساخت پول پروسس نبردها با spawn تا وضعیت حلقه و اتصال دیتابیس کپی نشود"""
+        return ProcessPoolExecutor(
+            max_workers=TOURNAMENT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    async def resume_tournaments(self):
+        """ادامه مسابقاتی که پیش از توقف ربات نیمه‌کاره مانده‌اند"""
+        self.cursor.execute("SELECT id FROM tournaments WHERE status = 'running'")
+        for (tournament_id,) in self.cursor.fetchall():
+            self.start_background_task(self.run_tournament(tournament_id))
+
+    def _create_round(self, tournament_id: int, round_number: int, players: List[tuple]):
+        """ساخت جفت‌های یک دور حذفی؛ قوی‌ترین با ضعیف‌ترین"""
+        players = sorted(players, key=lambda player: player[1], reverse=True)
+        matches = []
+        if len(players) % 2:
+            # نفر اول بدون حریف به دور بعد می‌رود
+            bye = players.pop(0)[0]
+            matches.append((tournament_id, round_number, bye, None, bye))
+        for i in range(len(players) // 2):
+            matches.append((tournament_id, round_number, players[i][0], players[-1 - i][0], None))
+        
+        self.cursor.executemany('''
+            INSERT INTO tournament_matches (tournament_id, round, player_a, player_b, winner_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', matches)
+        self.cursor.execute(
+            "UPDATE tournaments SET status = 'running', current_round = ? WHERE id = ?",
+            (round_number, tournament_id)
+        )
+        self.conn.commit()
+
+    async def run_tournament(self, tournament_id: int):
+        """اجرای دور به دور مسابقه با شبیه‌سازی نبردها در پروسس‌های جداگانه
+
+        نتیجه هر بسته نبرد بلافاصله در دیتابیس ذخیره می‌شود، پس بعد از کرش
+        فقط نبردهای بدون نتیجه دوباره اجرا می‌شوند.
+        """
+        if self.battle_pool is None:
+            self.battle_pool = self.create_battle_pool()
+        loop = asyncio.get_running_loop()
+        
+        self.cursor.execute('SELECT current_round FROM tournaments WHERE id = ?', (tournament_id,))
+        round_number = self.cursor.fetchone()[0]
+        if round_number == 0:
+            self.cursor.execute(
+                'SELECT user_id, power FROM tournament_entries WHERE tournament_id = ?',
+                (tournament_id,)
+            )
+            round_number = 1
+            self._create_round(tournament_id, round_number, self.cursor.fetchall())
+            logger.info(f"مسابقه {tournament_id} شروع شد")
+        
+        while True:
+            self.cursor.execute('''
+                SELECT m.id, m.player_a, a.power, m.player_b, b.power
+                FROM tournament_matches m
+                JOIN tournament_entries a ON a.tournament_id = m.tournament_id AND a.user_id = m.player_a
+                JOIN tournament_entries b ON b.tournament_id = m.tournament_id AND b.user_id = m.player_b
+                WHERE m.tournament_id = ? AND m.round = ? AND m.winner_id IS NULL
+            ''', (tournament_id, round_number))
+            pending = self.cursor.fetchall()
+            
+            chunks = [
+                pending[i:i + TOURNAMENT_CHUNK_SIZE]
+                for i in range(0, len(pending), TOURNAMENT_CHUNK_SIZE)
+            ]
+            futures = [loop.run_in_executor(self.battle_pool, simulate_battles, chunk) for chunk in chunks]
+            for future in asyncio.as_completed(futures):
+                results = await future
+                self.cursor.executemany(
+                    'UPDATE tournament_matches SET winner_id = ? WHERE id = ?',
+                    results
+                )
+                self.conn.commit()
+            
+            self.cursor.execute('''
+                SELECT m.player_a, m.player_b, m.winner_id, e.power
+                FROM tournament_matches m
+                JOIN tournament_entries e ON e.tournament_id = m.tournament_id AND e.user_id = m.winner_id
+                WHERE m.tournament_id = ? AND m.round = ?
+            ''', (tournament_id, round_number))
+            finished = self.cursor.fetchall()
+            for player_a, player_b, winner_id, power in finished:
+                if player_b is None:
+                    continue
+                loser_id = player_b if winner_id == player_a else player_a
+                self.queue_notification(winner_id, f"🏆 **مسابقه {tournament_id}:** دور {round_number} را بردید! ⚔️")
+                self.queue_notification(loser_id, f"🏆 **مسابقه {tournament_id}:** در دور {round_number} حذف شدید. 💔")
+            
+            if len(finished) <= 1:
+                winner_id = finished[0][2] if finished else None
+                self.cursor.execute('''
+                    UPDATE tournaments SET status = 'finished', finished_at = ?, winner_id = ?
+                    WHERE id = ?
+                ''', (datetime.datetime.now().isoformat(), winner_id, tournament_id))
+                self.conn.commit()
+                if winner_id is not None:
+                    self.queue_notification(winner_id, f"👑 **قهرمان مسابقه {tournament_id} شدید!** 🎉")
+                logger.info(f"مسابقه {tournament_id} تمام شد؛ قهرمان: {winner_id}")
+                break
+            
+            round_number += 1
+            self._create_round(
+                tournament_id, round_number,
+                [(winner_id, power) for _, _, winner_id, power in finished]
+            )
+            await self.flush_notifications()
+        
+        await self.flush_notifications()
+
+    # متدهای اعلان
+    def queue_notification(self, user_id: int, text: str):
+        """افزودن یک اعلان به صف ارسال"""
+        self.notifications.append((user_id, text))
+
+    async def flush_notifications(self):
+        """ارسال اعلان‌های صف در دسته‌های محدود"""
+        async with self.notify_lock:
+            while self.notifications:
+                batch = [
+                    self.notifications.popleft()
+                    for _ in range(min(NOTIFY_BATCH_SIZE, len(self.notifications)))
+                ]
+                await asyncio.gather(*(self.send_limited(user_id, text) for user_id, text in batch))
+
+    async def send_limited(self, user_id: int, text: str) -> bool:
+        """ارسال یک پیام با رعایت حداکثر همزمانی و نرخ ارسال"""
+        async with self.send_semaphore:
+            for attempt in range(SEND_MAX_RETRIES + 1):
+                # هر ارسال یک نوبت زمانی رزرو می‌کند؛ نرخ کلی از SEND_RATE بیشتر نمی‌شود
+                now = time.monotonic()
+                send_at = max(now, self.next_send_time)
+                self.next_send_time = send_at + 1 / SEND_RATE
+                if send_at > now:
+                    await asyncio.sleep(send_at - now)
+                try:
+                    await self.bot.send_message(user_id, text)
+                    return True
+                except (TooManyRequestsError, FloodError) as e:
+                    # مکث اعلام‌شده سرور برای همه ارسال‌ها اعمال می‌شود، نه فقط همین پیام
+                    delay = getattr(e, 'seconds', 0) or SEND_RETRY_DELAY
+                    self.next_send_time = max(self.next_send_time, time.monotonic() + delay)
+                    logger.warning(f"محدودیت نرخ هنگام ارسال به {user_id}؛ تلاش دوباره پس از {delay} ثانیه")
+                except Exception as e:
+                    logger.warning(f"ارسال پیام به {user_id} ناموفق بود: {e}")
+                    return False
+            logger.warning(f"ارسال پیام به {user_id} پس از {SEND_MAX_RETRIES} تلاش دوباره ناموفق بود")
+            return False
+
+    # متدهای پیام همگانی
+    def iter_recipients(self, after_user_id: int, chunk_size: int = BROADCAST_CHUNK_SIZE):
+        """گیرندگان به صورت بسته‌های پشت سر هم با صفحه‌بندی کلیدی
+
+        هر بسته با یک کوئری روی کلید اصلی خوانده می‌شود و کل لیست بازیکنان
+        هیچ‌وقت در حافظه نیست.
+        """
+        while True:
+            chunk = [
+                user_id for (user_id,) in self.conn.execute(
+                    'SELECT user_id FROM players WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                    (after_user_id, chunk_size)
+                )
+            ]
+            if not chunk:
+                return
+            yield chunk
+            after_user_id = chunk[-1]
+
+    async def start_broadcast(self, text: str, created_by: Optional[int] = None) -> int:
+        """ثبت و شروع ارسال یک پیام همگانی"""
+        self.cursor.execute(
+            'INSERT INTO broadcasts (text, created_by, created_at) VALUES (?, ?, ?)',
+            (text, created_by, datetime.datetime.now().isoformat())
+        )
+        self.conn.commit()
+        broadcast_id = self.cursor.lastrowid
+        self.start_background_task(self.run_broadcast(broadcast_id))
+        return broadcast_id
+
+    async def resume_broadcasts(self):
+        """ادامه پیام‌های همگانی نیمه‌کاره از آخرین نقطه ذخیره‌شده"""
+        self.cursor.execute("SELECT id FROM broadcasts WHERE status = 'running'")
+        for (broadcast_id,) in self.cursor.fetchall():
+            self.start_background_task(self.run_broadcast(broadcast_id))
+
+    async def run_broadcast(self, broadcast_id: int):
+        """ارسال پیام همگانی بسته به بسته با ذخیره نقطه توقف پس از هر بسته"""
+        self.cursor.execute(
+            'SELECT text, last_user_id, created_by FROM broadcasts WHERE id = ?',
+            (broadcast_id,)
+        )
+        text, last_user_id, created_by = self.cursor.fetchone()
+        
+        for chunk in self.iter_recipients(last_user_id):
+            started = time.monotonic()
+            results = await asyncio.gather(*(self.send_limited(user_id, text) for user_id in chunk))
+            sent = sum(results)
+            elapsed = time.monotonic() - started
+            
+            self.cursor.execute('''
+                UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?,
+                    elapsed = elapsed + ?
+                WHERE id = ?
+            ''', (chunk[-1], sent, len(chunk) - sent, elapsed, broadcast_id))
+            self.conn.commit()
+            logger.info(f"پیام همگانی {broadcast_id}: {len(chunk) / max(elapsed, 1e-6):.1f} پیام در ثانیه")
+        
+        self.cursor.execute(
+            "UPDATE broadcasts SET status = 'finished', finished_at = ? WHERE id = ?",
+            (datetime.datetime.now().isoformat(), broadcast_id)
+        )
+        self.conn.commit()
+        
+        stats = self.get_broadcast_stats(broadcast_id)
+        logger.info(f"پیام همگانی {broadcast_id} تمام شد: {stats}")
+        if created_by is not None:
+            self.queue_notification(created_by, f"""
+📢 **پیام همگانی {broadcast_id} ارسال شد**
+
+• ✅ موفق: {stats['sent']:,}
+• ❌ ناموفق: {stats['failed']:,}
+• ⏱️ زمان: {stats['elapsed']:.0f} ثانیه
+• ⚡ سرعت: {stats['throughput']:.1f} پیام در ثانیه
+            """)
+            await self.flush_notifications()
+
+    def get_broadcast_stats(self, broadcast_id: int) -> Dict:
+        """آمار ارسال یک پیام همگانی"""
+        self.cursor.execute(
+            'SELECT status, sent, failed, elapsed FROM broadcasts WHERE id = ?',
+            (broadcast_id,)
+        )
+        status, sent, failed, elapsed = self.cursor.fetchone()
+        return {
+            'status': status,
+            'sent': sent,
+            'failed': failed,
+            'elapsed': elapsed,
+            'throughput': (sent + failed) / elapsed if elapsed else 0.0
+        }
+
+    # متدهای جلسه
+    def load_sessions(self):
+        """بارگذاری جلسه‌های ذخیره‌شده پس از راه‌اندازی دوباره"""
+        if not SESSION_PERSIST:
+            return
+        now = time.time()
+        self.cursor.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+        self.cursor.execute('SELECT user_id, state, payload, expires_at FROM sessions')
+        for user_id, state, payload, expires_at in self.cursor.fetchall():
+            self.sessions.set(user_id, state, json.loads(payload), ttl=expires_at - now)
+        self.conn.commit()
+
+    def get_session(self, user_id: int) -> Optional[tuple]:
+        """وضعیت فعلی جلسه کاربر"""
+        return self.sessions.get(user_id)
+
+    def set_session(self, user_id: int, state: int, payload: tuple = ()):
+        """ثبت وضعیت جلسه در حافظه و دیتابیس"""
+        self.sessions.set(user_id, state, payload)
+        if not SESSION_PERSIST:
+            return
+        self.cursor.execute(
+            'INSERT OR REPLACE INTO sessions (user_id, state, payload, expires_at) VALUES (?, ?, ?, ?)',
+            (user_id, state, json.dumps(list(payload)), time.time() + SESSION_TTL)
+        )
+        self.conn.commit()
+
+    def clear_session(self, user_id: int):
+        """پایان جلسه کاربر"""
+        self.sessions.clear(user_id)
+        if not SESSION_PERSIST:
+            return
+        self.cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+        self.conn.commit()
+
+    def spend_resources(self, user_id: int, costs: Dict) -> bool:
+        """کسر منابع در صورت کافی بودن (بدون commit)"""
+        columns = ', '.join(f"{resource} = {resource} - ?" for resource in costs)
+        conditions = ' AND '.join(f"{resource} >= ?" for resource in costs)
+        self.cursor.execute(
+            f'UPDATE players SET {columns} WHERE user_id = ? AND {conditions}',
+            (*costs.values(), user_id, *costs.values())
+        )
+        return self.cursor.rowcount > 0
+
+    # متدهای شبیه‌سازی شهر
+    def settle_city(self, user_id: int):
+        """بروزرسانی تنبل شهر اصلی بازیکن در زمان دسترسی"""
+        now = time.time()
+        self.cursor.execute(
+            'SELECT id, upgrade_finish_time FROM cities WHERE user_id = ? ORDER BY id LIMIT 1',
+            (user_id,)
+        )
+        row = self.cursor.fetchone()
+        # زمان پایان ارتقاء مثل ساختمان‌ها و تحقیقات به صورت ISO ذخیره می‌شود
+        if row and row[1] is not None and row[1] <= datetime.datetime.now().isoformat():
+            # ارتقاء تمام‌شده پیش از شبیه‌سازی اعمال می‌شود تا ظرفیت سطح جدید حساب شود
+            self.cursor.execute(
+                'UPDATE cities SET level = level + 1, upgrade_finish_time = NULL WHERE id = ?',
+                (row[0],)
+            )
+            self.conn.commit()
+            self.invalidate_spy_report(user_id)
+        
+        self.cursor.execute(CITY_SIM_QUERY + '''
+            WHERE c.id = (SELECT MIN(id) FROM cities WHERE user_id = ?)
+              AND (c.last_update_time IS NULL OR c.last_update_time <= ?)
+            GROUP BY c.id
+        ''', (user_id, now - CITY_SIM_STEP))
+        rows = self.cursor.fetchall()
+        if rows:
+            updates, food_used = simulate_city_batch(rows, now)
+            self.cursor.executemany('''
+                UPDATE cities SET population = ?, happiness = ?, defense = ?, last_update_time = ?
+                WHERE id = ?
+            ''', updates)
+            self.cursor.executemany(
+                'UPDATE players SET food = MAX(food - ?, 0) WHERE user_id = ?',
+                food_used
+            )
+            self.conn.commit()
+            self.invalidate_spy_report(user_id)
+
+    async def run_city_tick(self, budget: float = CITY_TICK_BUDGET) -> int:
+        """یک تیک شبیه‌سازی دسته‌ای برای شهرهای آفلاین (در ترد جداگانه)"""
+        # commit از اتصال دیگر بکاپ در جریان را از اول شروع می‌کند؛ تیک و بکاپ همزمان اجرا نمی‌شوند
+        async with self.backup_lock:
+            processed, touched = await asyncio.to_thread(self._run_city_tick, budget)
+        # گزارش جاسوسی شهرهای تغییرکرده دیگر معتبر نیست؛ کش کوچک‌تر پیمایش می‌شود
+        for target_id in [target_id for target_id in self.spy_reports if target_id in touched]:
+            self.invalidate_spy_report(target_id)
+        logger.info(f"تیک شبیه‌سازی شهرها: {processed:,} شهر")
+        return processed
+
+    def _run_city_tick(self, budget: float) -> tuple:
+        """پردازش دسته‌های شهر تا پایان بودجه زمانی
+
+        شهرها به ترتیب شناسه و از جایی که تیک قبلی متوقف شده پیمایش می‌شوند و
+        هر دسته با یک executemany نوشته می‌شود. اتصال جداگانه باعث می‌شود
+        تراکنش‌های این ترد با تراکنش‌های هندلرها مخلوط نشود. خروجی تعداد
+        شهرهای پردازش‌شده و مجموعه بازیکنانی است که شهرشان تغییر کرده.
+        """
+        conn = sqlite3.connect(DATABASE_PATH)
+        started = time.monotonic()
+        processed = 0
+        touched = set()
+        try:
+            # ارتقاءهای تمام‌شده با یک UPDATE روی ایندکس جزئی اعمال می‌شوند
+            touched.update(user_id for (user_id,) in conn.execute('''
+                UPDATE cities SET level = level + 1, upgrade_finish_time = NULL
+                WHERE upgrade_finish_time <= ?
+                RETURNING user_id
+            ''', (datetime.datetime.now().isoformat(),)).fetchall())
+            conn.commit()
+            while time.monotonic() - started < budget:
+                now = time.time()
+                rows = conn.execute(CITY_SIM_QUERY + '''
+                    WHERE c.id > ?
+                    GROUP BY c.id
+                    ORDER BY c.id
+                    LIMIT ?
+                ''', (self.city_sim_cursor, CITY_SIM_BATCH)).fetchall()
+                if not rows:
+                    # پایان دور؛ دور بعد از ابتدای جدول شروع می‌شود
+                    self.city_sim_cursor = 0
+                    break
+                
+                self.city_sim_cursor = rows[-1][0]
+                stale = now - CITY_SIM_INTERVAL
+                rows = [row for row in rows if row[5] is None or row[5] <= stale]
+                updates, food_used = simulate_city_batch(rows, now)
+                conn.executemany('''
+                    UPDATE cities SET population = ?, happiness = ?, defense = ?, last_update_time = ?
+                    WHERE id = ?
+                ''', updates)
+                # مصرف غذا در همان تراکنش دسته کسر می‌شود
+                conn.executemany(
+                    'UPDATE players SET food = MAX(food - ?, 0) WHERE user_id = ?',
+                    food_used
+                )
+                conn.commit()
+                processed += len(rows)
+                touched.update(row[-1] for row in rows)
+        finally:
+            conn.close()
+        return processed, touched
+
+    async def set_tax_rate(self, callback_query: CallbackQuery, tax_rate: int):
+        """تغییر نرخ مالیات شهر اصلی"""
+        user_id = callback_query.from_user.id
+        if tax_rate in TAX_RATES:
+            # وضعیت تا این لحظه با مالیات قبلی حساب می‌شود
+            self.settle_city(user_id)
+            self.cursor.execute('''
+                UPDATE cities SET tax_rate = ?
+                WHERE id = (SELECT MIN(id) FROM cities WHERE user_id = ?)
+            ''', (tax_rate, user_id))
+            self.conn.commit()
+        await self.show_city_report(callback_query, "income")
+
+    # متدهای شناسایی و جاسوسی
+    def get_power_band(self, power: int) -> int:
+        """باند قدرت لگاریتمی؛ هر باند دو برابر باند قبلی"""
+        return max(int(power), 0).bit_length()
+
+    def _load_scout_index(self):
+        """ساخت ایندکس اهداف بر اساس باند قدرت و منطقه (در ترد جداگانه)"""
+        # اتصال جداگانه تا خواندن این ترد با تراکنش‌های اتصال اصلی مخلوط نشود
+        conn = sqlite3.connect(DATABASE_PATH)
+        try:
+            rows = conn.execute('''
+                SELECT p.user_id, p.army + COALESCE(SUM(c.defense), 0),
+                       MIN(c.position_x), MIN(c.position_y)
+                FROM players p
+                JOIN cities c ON c.user_id = p.user_id
+                GROUP BY p.user_id
+            ''').fetchall()
+        finally:
+            conn.close()
+        
+        index = {}
+        positions = {}
+        for user_id, power, position_x, position_y in rows:
+            key = (
+                self.get_power_band(power),
+                (position_x or 0) // REGION_SIZE,
+                (position_y or 0) // REGION_SIZE
+            )
+            index.setdefault(key, []).append(user_id)
+            positions[user_id] = (key, power)
+        return index, positions
+
+    async def refresh_scout_index(self):
+        """بازسازی ایندکس اهداف؛ هر SCOUT_INDEX_TTL ثانیه در پس‌زمینه اجرا می‌شود"""
+        async with self.scout_refresh_lock:
+            index, positions = await asyncio.to_thread(self._load_scout_index)
+            self.scout_index, self.scout_positions = index, positions
+            logger.info(f"ایندکس شناسایی بروزرسانی شد: {len(positions)} بازیکن")
+
+    async def find_weak_target(self, user_id: int) -> Optional[int]:
+        """پیدا کردن دشمن ضعیف‌تر در منطقه بازیکن و مناطق همسایه
+
+        فقط تعداد ثابتی از خانه‌های ایندکس بررسی می‌شود، پس هزینه جستجو به
+        تعداد بازیکنان بستگی ندارد. ایندکس فقط خوانده می‌شود و بازسازی آن کار
+        پس‌زمینه است، پس هیچ درخواستی منتظر پیمایش جدول‌ها نمی‌ماند.
+        """
+        position = self.scout_positions.get(user_id)
+        if position is None:
+            return None
+        
+        (band, region_x, region_y), power = position
+        neighbours = [(0, 0)] + [
+            (dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)
+        ]
+        for target_band in range(band, max(band - SCOUT_BAND_RANGE, 0) - 1, -1):
+            for dx, dy in neighbours:
+                bucket = self.scout_index.get((target_band, region_x + dx, region_y + dy))
+                if not bucket:
+                    continue
+                # چند نمونه تصادفی کافی است؛ در باند خود بازیکن، هدف قوی‌تر یا خود او رد می‌شود
+                for target_id in random.sample(bucket, min(3, len(bucket))):
+                    if target_id == user_id:
+                        continue
+                    if target_band < band or self.scout_positions[target_id][1] <= power:
+                        return target_id
+        return None
+
+    async def get_spy_report(self, target_id: int) -> Optional[Dict]:
+        """دریافت گزارش جاسوسی با کش زمان‌دار"""
+        now = time.monotonic()
+        # گزارش‌ها به ترتیب انقضا مرتب‌اند؛ در هر فراخوانی حداکثر دو گزارش منقضی حذف می‌شود
+        for _ in range(2):
+            if not self.spy_reports or next(iter(self.spy_reports.values()))[0] > now:
+                break
+            self.spy_reports.popitem(last=False)
+        
+        cached = self.spy_reports.get(target_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        self.cursor.execute('''
+            SELECT p.first_name, p.level, p.army, p.gold, p.food, p.wood, p.stone, p.iron,
+                   c.city_name, c.population, c.defense, c.position_x, c.position_y
+            FROM players p
+            JOIN cities c ON c.user_id = p.user_id
+            WHERE p.user_id = ?
+            ORDER BY c.id
+            LIMIT 1
+        ''', (target_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            self.spy_reports.pop(target_id, None)
+            return None
+        
+        report = dict(zip((
+            'name', 'level', 'army', 'gold', 'food', 'wood', 'stone', 'iron',
+            'city_name', 'population', 'defense', 'position_x', 'position_y'
+        ), row))
+        report['name'] = report['name'] or 'فرمانده ناشناس'
+        self.spy_reports[target_id] = (now + SPY_REPORT_TTL, report)
+        self.spy_reports.move_to_end(target_id)
+        return report
+
+    def invalidate_spy_report(self, target_id: int):
+        """حذف گزارش کش‌شده پس از تغییر وضعیت بازیکن"""
+        self.spy_reports.pop(target_id, None)
+
+    # کارهای پس‌زمینه
+    async def start_background_jobs(self):
+        """شروع کارهای دوره‌ای پس از راه‌اندازی ربات"""
+        if self.battle_pool is None:
+            self.battle_pool = self.create_battle_pool()
+        await self.resume_tournaments()
+        await self.resume_broadcasts()
+        self.start_background_task(self.refresh_scout_index())
+        self.start_background_task(self.run_periodically(SCOUT_INDEX_TTL, self.refresh_scout_index))
+        self.start_background_task(self.run_periodically(BACKUP_INTERVAL, self.create_periodic_snapshot))
+        self.start_background_task(self.run_periodically(STREAK_RESET_INTERVAL, self.reset_expired_streaks))
+        self.start_background_task(self.run_periodically(CITY_TICK_INTERVAL, self.run_city_tick))
+
+    async def stop_background_jobs(self):
+        """توقف کارهای پس‌زمینه هنگام خاموش شدن ربات"""
+        tasks = list(self.background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.battle_pool is not None:
+            self.battle_pool.shutdown(wait=False, cancel_futures=True)
+            self.battle_pool = None
+
+    async def run_periodically(self, interval: float, job):
+        """اجرای دوره‌ای یک کار؛ خطای یک اجرا اجراهای بعدی را متوقف نمی‌کند"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"خطا در کار دوره‌ای {job.__name__}: {e}")
+
+    # متدهای پشتیبان‌گیری
+    async def create_periodic_snapshot(self):
+        """پشتیبان فشرده دوره‌ای و حذف نسخه‌های قدیمی"""
+        await self.create_snapshot(compress=True)
+        # حذف داخل قفل انجام می‌شود تا با بازگردانی در جریان همپوشانی نداشته باشد
+        async with self.backup_lock:
+            await asyncio.to_thread(self._prune_snapshots)
+
+    def _prune_snapshots(self):
+        """نگه داشتن فقط BACKUP_KEEP نسخه پشتیبان آخر"""
+        snapshots = sorted(
+            name for name in os.listdir(BACKUP_DIR)
+            if name.startswith('snapshot_') and name.endswith(SNAPSHOT_SUFFIXES)
+        )
+        for name in snapshots[:-BACKUP_KEEP]:
+            os.remove(os.path.join(BACKUP_DIR, name))
+
+    async def create_snapshot(self, compress: bool = False) -> str:
+        """گرفتن نسخه پشتیبان از دیتابیس بدون توقف ربات"""
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        
+        async with self.backup_lock:
+            # نام با دقت میکروثانیه و داخل قفل ساخته می‌شود تا دو نسخه روی هم نوشته نشوند
+            stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            snapshot_path = os.path.join(BACKUP_DIR, f"snapshot_{stamp}.db")
+            started = time.monotonic()
+            await asyncio.to_thread(self._write_snapshot, snapshot_path)
+            if compress:
+                snapshot_path = await asyncio.to_thread(self._compress_snapshot, snapshot_path)
+            logger.info(f"پشتیبان ساخته شد: {snapshot_path} ({time.monotonic() - started:.1f} ثانیه)")
+        return snapshot_path
+
+    async def restore_snapshot(self, snapshot_path: str):
+        """بازگردانی دیتابیس از یک نسخه پشتیبان (فشرده یا معمولی)"""
+        async with self.backup_lock:
+            await asyncio.to_thread(self._restore_snapshot, snapshot_path)
+            # داده‌های کش‌شده مربوط به دیتابیس قبلی هستند
+            self.modifier_cache.clear()
+            self.spy_reports.clear()
+            self.start_background_task(self.refresh_scout_index())
+            logger.info(f"دیتابیس از پشتیبان بازگردانی شد: {snapshot_path}")
+
+    def _write_snapshot(self, snapshot_path: str):
+        """کپی صفحه‌به‌صفحه دیتابیس با API بکاپ SQLite (در ترد جداگانه)
+
+        منبع همان اتصال اصلی است؛ تغییراتی که از این اتصال در حین بکاپ
+        انجام شوند خودکار در نسخه مقصد هم اعمال می‌شوند، پس نسخه نهایی
+        همیشه یک وضعیت سازگار از دیتابیس است.
+        """
+        temp_path = snapshot_path + '.part'
+        target = sqlite3.connect(temp_path)
+        
+        def throttle(status, remaining, total):
+            # مکث بین گام‌ها تا هندلرها بین کپی صفحات به دیتابیس دسترسی داشته باشند
+            time.sleep(BACKUP_STEP_SLEEP)
+        
+        try:
+            self.conn.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=throttle)
+        finally:
+            target.close()
+        os.replace(temp_path, snapshot_path)
+
+    def _compress_snapshot(self, snapshot_path: str) -> str:
+        """فشرده‌سازی نسخه پشتیبان برای نگهداری بلندمدت"""
+        compressed_path = snapshot_path + '.gz'
+        with open(snapshot_path, 'rb') as source, gzip.open(compressed_path + '.part', 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(compressed_path + '.part', compressed_path)
+        os.remove(snapshot_path)
+        return compressed_path
+
+    def _restore_snapshot(self, snapshot_path: str):
+        """بازگردانی نسخه پشتیبان روی اتصال اصلی (در ترد جداگانه)"""
+        source_path = snapshot_path
+        if snapshot_path.endswith('.gz'):
+            source_path = snapshot_path[:-3] + '.restore'
+            with gzip.open(snapshot_path, 'rb') as source, open(source_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+        
+        # فقط‌خواندنی باز می‌شود تا فایل ناموجود به جای دیتابیس خالی خطا بدهد
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        try:
+            result = source.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                raise ValueError(f"فایل پشتیبان خراب است: {result}")
+            # کپی یکجا؛ سریع‌ترین حالت بازگردانی
+            source.backup(self.conn)
+        finally:
+            source.close()
+            if source_path != snapshot_path:
+                os.remove(source_path)
+
 # اجرای ربات
 if __name__ == "__main__":
     # 🔹 توکن ربات خود را اینجا قرار دهید
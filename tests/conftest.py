@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code1
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """ربات با دیتابیس تازه در پوشه موقت تست"""
+    monkeypatch.chdir(tmp_path)
+    game_bot = code1.AdvancedStrategicGameBot('1:test')
+    yield game_bot
+    game_bot.conn.close()
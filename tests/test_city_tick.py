@@ -0,0 +1,59 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import code1
+
+
+CITIES = 2_000
+
+
+@pytest.fixture
+def bot(bot):
+    """ربات با شهرهایی که آخرین بروزرسانی‌شان دو ساعت پیش بوده"""
+    stale = time.time() - 2 * code1.CITY_SIM_INTERVAL
+    bot.cursor.executemany(
+        'INSERT INTO players (user_id, username) VALUES (?, ?)',
+        [(user_id, f'player{user_id}') for user_id in range(1, CITIES + 1)]
+    )
+    bot.cursor.executemany(
+        "INSERT INTO cities (user_id, city_name, last_update_time) VALUES (?, 'شهر اصلی', ?)",
+        [(user_id, stale) for user_id in range(1, CITIES + 1)]
+    )
+    bot.conn.commit()
+    return bot
+
+
+def test_tick_and_snapshot_do_not_overlap(bot):
+    async def scenario():
+        return await asyncio.gather(bot.create_snapshot(), bot.run_city_tick(budget=5.0))
+
+    snapshot_path, processed = asyncio.run(scenario())
+    assert processed == CITIES
+    snapshot = sqlite3.connect(snapshot_path)
+    assert snapshot.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    # بکاپ پیش از تیک گرفته شده و هیچ بخشی از نوشته‌های تیک را ندارد
+    updated = snapshot.execute(
+        'SELECT COUNT(*) FROM cities WHERE last_update_time > ?',
+        (time.time() - code1.CITY_SIM_INTERVAL,)
+    ).fetchone()[0]
+    assert updated == 0
+    snapshot.close()
+
+
+def test_citizens_eat_from_player_stock(bot):
+    bot.cursor.execute('UPDATE players SET food = 5 WHERE user_id = 2')
+    bot.conn.commit()
+    bot.cursor.execute('SELECT population, food FROM cities JOIN players USING (user_id) WHERE user_id = 1')
+    population, food = bot.cursor.fetchone()
+
+    asyncio.run(bot.run_city_tick(budget=5.0))
+
+    # دو ساعت مصرف از انبار کم می‌شود؛ انبار کم‌تر از مصرف صفر می‌شود نه منفی
+    eaten = round(population * code1.FOOD_PER_CITIZEN_DAY * 2 / 24)
+    bot.cursor.execute('SELECT food FROM players WHERE user_id = 1')
+    assert bot.cursor.fetchone()[0] == pytest.approx(food - eaten, abs=1)
+    bot.cursor.execute('SELECT food FROM players WHERE user_id = 2')
+    assert bot.cursor.fetchone()[0] == 0
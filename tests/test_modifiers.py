@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+import time
+
+import code1
+
+
+def register(bot, user_id):
+    bot.cursor.execute('INSERT INTO players (user_id, username) VALUES (?, ?)', (user_id, 'player'))
+    bot.cursor.execute(
+        "INSERT INTO cities (user_id, city_name, last_update_time) VALUES (?, 'شهر اصلی', ?)",
+        (user_id, time.time() - 2 * code1.CITY_SIM_INTERVAL)
+    )
+    bot.conn.commit()
+
+
+def start_research(bot, user_id, tech_id, finish):
+    bot.cursor.execute(
+        'INSERT INTO research (user_id, tech_id, finish_time) VALUES (?, ?, ?)',
+        (user_id, tech_id, finish.isoformat())
+    )
+    bot.conn.commit()
+
+
+def test_lookup_leaves_no_open_transaction(bot):
+    register(bot, 1)
+    start_research(bot, 1, 'agriculture', datetime.datetime.now() + datetime.timedelta(hours=1))
+
+    async def scenario():
+        # بدون تحقیق تمام‌شده هیچ نوشتنی انجام نمی‌شود و قفل دیتابیس آزاد می‌ماند
+        await bot.get_modifiers(1)
+        assert not bot.conn.in_transaction
+        return await bot.run_city_tick(budget=5.0)
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_finished_research_updates_modifiers(bot):
+    register(bot, 1)
+    start_research(bot, 1, 'agriculture', datetime.datetime.now() - datetime.timedelta(seconds=1))
+
+    production, attack, build_speed = asyncio.run(bot.get_modifiers(1))
+    assert production == 1 + code1.TECH_TREE['agriculture']['effects']['production']
+    assert not bot.conn.in_transaction
+    bot.cursor.execute('SELECT completed FROM research WHERE user_id = 1')
+    assert bot.cursor.fetchone()[0]
+
+
+def test_modifier_cache_is_bounded(bot, monkeypatch):
+    monkeypatch.setattr(code1, 'MODIFIER_CACHE_SIZE', 3)
+
+    async def scenario():
+        for user_id in range(1, 6):
+            await bot.get_modifiers(user_id)
+
+    asyncio.run(scenario())
+    assert list(bot.modifier_cache) == [3, 4, 5]
@@ -0,0 +1,59 @@
+import asyncio
+
+import code1
+
+
+def register(bot, user_id):
+    bot.cursor.execute('INSERT INTO players (user_id, username) VALUES (?, ?)', (user_id, 'player'))
+    bot.conn.commit()
+
+
+def resources(bot, user_id):
+    bot.cursor.execute('SELECT gold, mana FROM players WHERE user_id = ?', (user_id,))
+    return bot.cursor.fetchone()
+
+
+def test_repeated_claim_pays_once(bot):
+    register(bot, 1)
+    before = resources(bot, 1)
+
+    async def double_tap():
+        return await asyncio.gather(*(bot.grant_reward(1, 'daily') for _ in range(3)))
+
+    results = asyncio.run(double_tap())
+    granted = [result for result in results if result[0]]
+    assert len(granted) == 1
+    # لمس‌های بعدی همان پاداش ثبت‌شده را برمی‌گردانند
+    assert all(result[1] == granted[0][1] and result[2] == 1 for result in results)
+
+    daily = code1.REWARD_TABLES['daily']
+    assert resources(bot, 1) == (before[0] + daily['gold'], before[1] + daily['mana'])
+    bot.cursor.execute('SELECT COUNT(*) FROM reward_claims WHERE user_id = 1')
+    assert bot.cursor.fetchone()[0] == 1
+    bot.cursor.execute("SELECT streak FROM reward_streaks WHERE user_id = 1 AND reward_type = 'daily'")
+    assert bot.cursor.fetchone()[0] == 1
+
+
+def test_consecutive_period_extends_streak(bot):
+    register(bot, 1)
+    _, previous_period = bot.get_reward_periods('daily')
+    bot.cursor.execute(
+        "INSERT INTO reward_streaks (user_id, reward_type, last_period, streak) VALUES (1, 'daily', ?, 2)",
+        (previous_period,)
+    )
+    bot.conn.commit()
+
+    granted, rewards, streak = asyncio.run(bot.grant_reward(1, 'daily'))
+    assert granted and streak == 3
+    assert rewards['gold'] == int(code1.REWARD_TABLES['daily']['gold'] * (1 + 2 * code1.REWARD_STREAK_BONUS))
+
+
+def test_claim_without_player_keeps_token(bot):
+    assert asyncio.run(bot.grant_reward(1, 'daily')) == (False, None, 0)
+    assert not bot.conn.in_transaction
+    bot.cursor.execute('SELECT COUNT(*) FROM reward_claims')
+    assert bot.cursor.fetchone()[0] == 0
+
+    # پس از ثبت نام، پاداش همین دوره هنوز قابل دریافت است
+    register(bot, 1)
+    assert asyncio.run(bot.grant_reward(1, 'daily'))[0]
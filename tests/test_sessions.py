@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import code1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(code1.time, 'monotonic', fake)
+    return fake
+
+
+def test_session_expires_after_ttl(clock):
+    store = code1.SessionStore(ttl=10, tick=1.0)
+    store.set(1, code1.SESSION_TRAIN_COUNT, ('infantry',))
+
+    clock.now += 9
+    assert store.get(1) == (code1.SESSION_TRAIN_COUNT, ('infantry',))
+    clock.now += 1
+    assert store.get(1) is None
+    assert not store.sessions
+    assert not any(store.wheel)
+
+
+def test_replaced_session_gets_new_expiry(clock):
+    store = code1.SessionStore(ttl=10, tick=1.0)
+    store.set(1, code1.SESSION_TRAIN_COUNT, ('infantry',))
+    clock.now += 6
+    store.set(1, code1.SESSION_ATTACK_TARGET)
+
+    # خانه قبلی چرخ دیگر این کاربر را منقضی نمی‌کند
+    clock.now += 6
+    assert store.get(1) == (code1.SESSION_ATTACK_TARGET, ())
+    assert sum(len(slot) for slot in store.wheel) == 1
+    clock.now += 4
+    assert store.get(1) is None
+
+
+def test_long_idle_expires_every_session(clock):
+    store = code1.SessionStore(ttl=10, tick=1.0)
+    for user_id in range(100):
+        store.set(user_id, code1.SESSION_ATTACK_TARGET, ttl=1 + user_id % 10)
+
+    # فاصله‌ای بیشتر از طول چرخ؛ هر خانه حداکثر یکبار بررسی می‌شود
+    clock.now += 1_000
+    assert store.get(0) is None
+    assert not store.sessions
+
+
+def test_sessions_survive_reload(bot, monkeypatch):
+    bot.set_session(1, code1.SESSION_TRAIN_COUNT, ('archers',))
+    bot.set_session(2, code1.SESSION_UPGRADE_CONFIRM, (120,))
+    bot.cursor.execute('UPDATE sessions SET expires_at = ? WHERE user_id = 2', (time.time() - 1,))
+    bot.conn.commit()
+
+    reloaded = code1.AdvancedStrategicGameBot('1:test')
+    try:
+        assert reloaded.get_session(1) == (code1.SESSION_TRAIN_COUNT, ('archers',))
+        assert reloaded.get_session(2) is None
+        reloaded.cursor.execute('SELECT user_id FROM sessions')
+        assert reloaded.cursor.fetchall() == [(1,)]
+    finally:
+        reloaded.conn.close()
+
+
+def test_reloaded_session_keeps_remaining_ttl(bot, clock):
+    bot.set_session(1, code1.SESSION_ATTACK_TARGET)
+    bot.cursor.execute('UPDATE sessions SET expires_at = ? WHERE user_id = 1', (time.time() + 3,))
+    bot.conn.commit()
+
+    reloaded = code1.AdvancedStrategicGameBot('1:test')
+    try:
+        assert reloaded.get_session(1) == (code1.SESSION_ATTACK_TARGET, ())
+        clock.now += 4
+        assert reloaded.get_session(1) is None
+    finally:
+        reloaded.conn.close()
@@ -0,0 +1,110 @@
+import asyncio
+import gzip
+import os
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+import code1
+
+
+ROWS = 50_000
+
+
+@pytest.fixture
+def bot(bot, monkeypatch):
+    """ربات با جدول ledger بزرگ برای بررسی سازگاری بکاپ"""
+    # گام‌های کوچک تا بکاپ در چند مرحله انجام شود و نوشتن‌ها بین گام‌ها رخ دهند
+    monkeypatch.setattr(code1, 'BACKUP_PAGES_PER_STEP', 8)
+    monkeypatch.setattr(code1, 'BACKUP_STEP_SLEEP', 0.001)
+    bot.cursor.execute('CREATE TABLE ledger (id INTEGER PRIMARY KEY, credit INTEGER, debit INTEGER)')
+    bot.cursor.executemany(
+        'INSERT INTO ledger (credit, debit) VALUES (?, ?)',
+        [(i, -i) for i in range(ROWS)]
+    )
+    bot.conn.commit()
+    return bot
+
+
+async def transfer_until(bot, stop: asyncio.Event) -> int:
+    """نوشتن‌های همزمان که مجموع credit + debit را صفر نگه می‌دارند
+
+    هر انتقال دو ردیف دور از هم (در صفحه‌های متفاوت) را در یک تراکنش تغییر
+    می‌دهد؛ پس ثابت ماندن مجموع فقط وقتی برقرار است که بکاپ پاره نشده باشد.
+    """
+    writes = 0
+    while not stop.is_set():
+        amount = random.randint(1, 1000)
+        bot.cursor.execute(
+            'UPDATE ledger SET credit = credit + ? WHERE id = ?',
+            (amount, random.randint(1, 100))
+        )
+        bot.cursor.execute(
+            'UPDATE ledger SET debit = debit - ? WHERE id = ?',
+            (amount, random.randint(ROWS - 100, ROWS))
+        )
+        bot.conn.commit()
+        writes += 1
+        await asyncio.sleep(0)
+    return writes
+
+
+def ledger_state(conn):
+    return conn.execute('SELECT COUNT(*), SUM(credit + debit) FROM ledger').fetchone()
+
+
+def test_snapshot_is_consistent_under_concurrent_writes(bot, tmp_path):
+
+    async def scenario():
+        stop = asyncio.Event()
+        writer = asyncio.create_task(transfer_until(bot, stop))
+        snapshot_path = await bot.create_snapshot(compress=True)
+        stop.set()
+        return snapshot_path, await writer
+
+    snapshot_path, writes = asyncio.run(scenario())
+    assert writes > 0
+
+    plain_path = tmp_path / 'check.db'
+    with gzip.open(snapshot_path, 'rb') as source, open(plain_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    snapshot = sqlite3.connect(plain_path)
+    assert snapshot.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    assert ledger_state(snapshot) == (ROWS, 0)
+    snapshot.close()
+
+
+def test_restore_returns_to_snapshot_state(bot):
+    snapshot_path = asyncio.run(bot.create_snapshot(compress=True))
+
+    bot.cursor.execute('DELETE FROM ledger WHERE id <= 10')
+    bot.conn.commit()
+    assert ledger_state(bot.conn) != (ROWS, 0)
+
+    asyncio.run(bot.restore_snapshot(snapshot_path))
+    assert ledger_state(bot.conn) == (ROWS, 0)
+
+
+def test_snapshots_in_same_second_do_not_collide(bot):
+
+    async def scenario():
+        return await asyncio.gather(bot.create_snapshot(), bot.create_snapshot())
+
+    first, second = asyncio.run(scenario())
+    assert first != second
+
+
+def test_prune_keeps_restore_temp_files(bot, monkeypatch):
+    monkeypatch.setattr(code1, 'BACKUP_KEEP', 1)
+    older = asyncio.run(bot.create_snapshot(compress=True))
+    # فایل موقتی که بازگردانی یک نسخه فشرده در حین کار می‌سازد
+    restore_temp = older[:-3] + '.restore'
+    open(restore_temp, 'wb').close()
+
+    asyncio.run(bot.create_periodic_snapshot())
+    remaining = sorted(os.listdir(code1.BACKUP_DIR))
+    assert os.path.basename(restore_temp) in remaining
+    assert os.path.basename(older) not in remaining
+    assert len([name for name in remaining if name.endswith(code1.SNAPSHOT_SUFFIXES)]) == 1